@@ -1,97 +1,243 @@
 from cloudformation_seed import util, cfn_template
 
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 
+import hashlib
 import logging
+import threading
+import time
+from concurrent import futures
+from uuid import uuid4
 from colorama import Fore, Style
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, WaiterError
 
 
 log = logging.getLogger('stack-deployer')
 
 
+class PollingCoordinator(object):
+    def __init__(self, delay: int = 5) -> None:
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.waiters: Dict[str, Dict[str, Any]] = dict()
+        self.thread: Optional[threading.Thread] = None
+
+    def register(self, stack_name: str) -> Dict[str, Any]:
+        waiter = {'event': threading.Event(), 'status': None, 'error': None}
+        with self.lock:
+            self.waiters[stack_name] = waiter
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.poll, daemon=True)
+                self.thread.start()
+        return waiter
+
+    def deregister(self, stack_name: str, waiter: Dict[str, Any]) -> None:
+        # a waiter that gave up must not linger, it would keep the poll
+        # thread alive forever with no one listening
+        with self.lock:
+            if self.waiters.get(stack_name) is waiter:
+                del self.waiters[stack_name]
+
+    def describe_stack_statuses(self, c) -> Dict[str, str]:
+        statuses = dict()
+        for page in c.get_paginator('describe_stacks').paginate():
+            for xs in page['Stacks']:
+                statuses[xs['StackName']] = xs['StackStatus']
+        return statuses
+
+    def poll(self) -> None:
+        # one unfiltered DescribeStacks per tick serves every waiting stack,
+        # keeping the API call count flat no matter how many deploy in parallel
+        c = util.thread_session().client('cloudformation', config=util.CLIENT_CONFIG)
+        while True:
+            time.sleep(self.delay)
+            with self.lock:
+                if not self.waiters:
+                    # drop the handle while still holding the lock, so a
+                    # register() racing with this exit sees no live poller
+                    # and starts a replacement instead of orphaning itself
+                    self.thread = None
+                    return
+                # snapshot who was already waiting; a stack registered while
+                # the describe is in flight must not be resolved from a
+                # pre-operation snapshot (a fresh create would read as
+                # missing, an update as the previous update's completion)
+                pending = dict(self.waiters)
+            try:
+                statuses = self.describe_stack_statuses(c)
+            except Exception as e:
+                # a failure that survives the adaptive retries would kill
+                # this thread silently; hand it to every waiter so they
+                # re-raise right away instead of sitting out the timeout
+                with self.lock:
+                    for xw in self.waiters.values():
+                        xw['error'] = e
+                        xw['event'].set()
+                    self.waiters.clear()
+                    self.thread = None
+                return
+            with self.lock:
+                for stack_name, xw in pending.items():
+                    if self.waiters.get(stack_name) is not xw:
+                        continue
+                    # a stack gone from DescribeStacks has finished deleting
+                    status = statuses.get(stack_name, 'DELETE_COMPLETE')
+                    if status.endswith('_IN_PROGRESS'):
+                        continue
+                    xw['status'] = status
+                    xw['event'].set()
+                    del self.waiters[stack_name]
+
+
+poller = PollingCoordinator()
+
+
 class CloudformationStack(object):
+    WAITER_DELAY = 5
+    WAITER_MAX_ATTEMPTS = 720
 
-    def __init__(self, installation_name: str, template: cfn_template.CloudformationTemplate) -> None:
+    def __init__(self, installation_name: str, template: cfn_template.CloudformationTemplate,
+                    waiter_delay: Optional[int] = None, waiter_max_attempts: Optional[int] = None) -> None:
         self.template: cfn_template.CloudformationTemplate = template
         self.stack_name = f'{installation_name}-{self.template.name}'
+        self.stack_name_colored = f'{Fore.GREEN}{self.stack_name}{Style.RESET_ALL}'
         self.stack_parameters = None
+        self.cfn = util.thread_session().client('cloudformation', config=util.CLIENT_CONFIG)
+        self.waiter_delay = waiter_delay or self.WAITER_DELAY
+        self.waiter_max_attempts = waiter_max_attempts or self.WAITER_MAX_ATTEMPTS
         self.existing_stack = self.find_existing_stack()
         self.caps = ['CAPABILITY_IAM', 'CAPABILITY_NAMED_IAM', 'CAPABILITY_AUTO_EXPAND']
         self.stack = None
+        self.stack_outputs: Dict[str, str] = dict()
         self.stack_tags = []
+        self.request_token = hashlib.sha1(
+            f'{self.stack_name}:{self.template.template_url}'.encode()).hexdigest()[:36]
 
     def set_parameters(self, parameters: util.StackParameters) -> None:
         self.stack_parameters = parameters
 
     def find_existing_stack(self) -> Optional[Dict[str, Any]]:
-        c = util.session.client('cloudformation')
         try:
-            r = c.describe_stacks(StackName=self.stack_name)
-            log.info(f'Stack {Fore.GREEN}{self.stack_name}{Style.RESET_ALL} exists')
-            return r['Stacks'].pop()
-        except Exception:
-            log.info(f'Stack {Fore.GREEN}{self.stack_name}{Style.RESET_ALL} does not exist')
-            return None
+            stack = util.describe_all_stacks().get(self.stack_name)
+        except ClientError as e:
+            # a throttle or permission error must propagate and retry, only a
+            # genuine 'does not exist' means the stack is safe to create
+            code = e.response['Error']['Code']
+            message = e.response['Error']['Message']
+            if code != 'ValidationError' or 'does not exist' not in message:
+                raise
+            stack = None
+        if stack is not None:
+            log.info('Stack %s exists', self.stack_name_colored)
+            return stack
+        log.info('Stack %s does not exist', self.stack_name_colored)
+        return None
 
     def get_stack_output(self, output_name: str) -> Optional[str]:
         if self.stack is None:
-            log.debug(f'Can\'t find output {self.stack_name}.{output_name}, stack has not been yet deployed')
+            log.debug('Can\'t find output %s.%s, stack has not been yet deployed', self.stack_name, output_name)
             return None
-        for xo in self.stack.outputs:
-            if xo['OutputKey'] == output_name:
-                log.debug(f'Output {self.stack_name}.{output_name} = {xo["OutputValue"]}')
-                return xo['OutputValue']
+        val = self.stack_outputs.get(output_name)
+        if val is not None:
+            log.debug('Output %s.%s = %s', self.stack_name, output_name, val)
+        return val
 
     def format_tags(self, tags_passed):
-        self.stack_tags = [{'Key': k, 'Value': str(v)} for k, v in tags_passed.items() if v is not None]
+        self.validate_tags(tags_passed)
 
     def validate_tags(self, tags_passed):
+        # validate and format in a single pass over the tags
+        tags_out = list()
         for k, v in tags_passed.items():
-            if len(k) > 127:
+            if v is None:
+                continue
+            key, value = str(k), str(v)
+            if len(key) > 127:
                 raise RuntimeError('Tag Key {0} cannot be more than 127 characters long'.format(k))
-            if len(v) > 255:
+            if len(value) > 255:
                 raise RuntimeError('Tag Value {0} cannot be more than 255 characters long'.format(v))
-        self.format_tags(tags_passed)
+            tags_out.append({'Key': key, 'Value': value})
+        self.stack_tags = tags_out
 
-    def create_stack(self) -> None:
-        c = util.session.client('cloudformation')
-        log.info(f'Creating stack {Fore.GREEN}{self.stack_name}{Style.RESET_ALL} with template'
-            f' {Fore.GREEN}{self.template.template_url}{Style.RESET_ALL}')
-        c.create_stack(
+    def start_create(self) -> str:
+        log.info('Creating stack %s with template %s%s%s',
+            self.stack_name_colored, Fore.GREEN, self.template.template_url, Style.RESET_ALL)
+        r = self.cfn.create_stack(
             StackName=self.stack_name,
             TemplateURL=self.template.template_url,
             Parameters=self.stack_parameters.format_parameters(),
             DisableRollback=True,
             Capabilities=self.caps,
-            Tags=self.stack_tags
+            Tags=self.stack_tags,
+            ClientRequestToken=f'{self.request_token}-create'
         )
+        return r['StackId']
+
+    def finalize_create(self) -> None:
         self.wait('stack_create_complete')
         self.retrieve()
 
+    def create_stack(self) -> None:
+        self.start_create()
+        self.finalize_create()
+
+    def stack_need_update(self, p) -> bool:
+        current_parameters = [{'ParameterKey': xp['ParameterKey'], 'ParameterValue': xp.get('ParameterValue')}
+            for xp in self.existing_stack.get('Parameters', list())]
+        if sorted(current_parameters, key=lambda x: x['ParameterKey']) != \
+                sorted(p, key=lambda x: x['ParameterKey']):
+            return True
+        if sorted(self.existing_stack.get('Tags', list()), key=lambda x: x['Key']) != \
+                sorted(self.stack_tags, key=lambda x: x['Key']):
+            return True
+        r = self.cfn.get_template(StackName=self.stack_name, TemplateStage='Original')
+        current_template = r['TemplateBody']
+        if not isinstance(current_template, str):
+            # JSON templates come back parsed, comparing them cheaply is not worth it
+            return True
+        return cfn_template.CloudformationTemplateBody(current_template).checksum != self.template.template_checksum
+
     def update_stack(self) -> None:
-        c = util.session.client('cloudformation')
         p = self.stack_parameters.format_parameters()
-        log.info(f'Updating stack {Fore.GREEN}{self.stack_name}{Style.RESET_ALL} with template'
-            f' {Fore.GREEN}{self.template.template_url}{Style.RESET_ALL}')
-        log.debug(' Parameters '.center(48, '-'))
-        log.debug(p)
-        log.debug('-'.center(48, '-'))
+        if not self.stack_need_update(p):
+            log.info('No changes to template or parameters of stack %s, skipping update',
+                self.stack_name_colored)
+            self.retrieve()
+            return
+        log.info('Updating stack %s with template %s%s%s',
+            self.stack_name_colored, Fore.GREEN, self.template.template_url, Style.RESET_ALL)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(' Parameters '.center(48, '-'))
+            log.debug(p)
+            log.debug('-'.center(48, '-'))
+        change_set_id = uuid4().hex[:8]
+        r = self.cfn.create_change_set(
+            StackName=self.stack_name,
+            TemplateURL=self.template.template_url,
+            Parameters=p,
+            Capabilities=self.caps,
+            Tags=self.stack_tags,
+            ChangeSetName=f'{self.stack_name}-{change_set_id}',
+            ChangeSetType='UPDATE'
+        )
+        waiter = self.cfn.get_waiter('change_set_create_complete')
         try:
-            c.update_stack(
-                StackName=self.stack_name,
-                TemplateURL=self.template.template_url,
-                Parameters=p,
-                Capabilities=self.caps,
-                Tags=self.stack_tags
-            )
-
-            self.wait('stack_update_complete')
-        except ClientError as e:
-            if e.response['Error']['Message'] == 'No updates are to be performed.':
-                log.info(f'No updates are to be done on stack {Fore.GREEN}{self.stack_name}{Style.RESET_ALL}')
-            else:
-                raise
+            waiter.wait(ChangeSetName=r['Id'], WaiterConfig={'Delay': 3, 'MaxAttempts': 100})
+        except WaiterError:
+            cs = self.cfn.describe_change_set(ChangeSetName=r['Id'])
+            reason = cs.get('StatusReason', '')
+            if cs['Status'] == 'FAILED' and \
+                    ('didn\'t contain changes' in reason or 'No updates are to be performed' in reason):
+                log.info('No updates are to be done on stack %s', self.stack_name_colored)
+                self.cfn.delete_change_set(ChangeSetName=r['Id'])
+                self.retrieve()
+                return
+            raise util.DeploymentFailed(f'Change set for stack {self.stack_name} failed: '
+                f'{cs.get("StatusReason")}') from None
+        log.info('Executing change set on stack %s...', self.stack_name_colored)
+        self.cfn.execute_change_set(ChangeSetName=r['Id'],
+            ClientRequestToken=f'{self.request_token}-{change_set_id}')
+        self.wait('stack_update_complete')
         self.retrieve()
 
     def deploy(self) -> None:
@@ -100,27 +246,69 @@ class CloudformationStack(object):
         else:
             self.update_stack()
 
-    def teardown(self) -> None:
-        if self.existing_stack is None:
-            log.warning(f'Stack {self.stack_name} does not exist. Skipping.')
+    @classmethod
+    def deploy_many(cls, stacks: List[Any]) -> None:
+        if len(stacks) == 1:
+            stacks[0].deploy()
             return
-        c = util.session.client('cloudformation')
-        log.info(f'Deleting stack {Fore.GREEN}{self.stack_name}{Style.RESET_ALL}...')
-        c.delete_stack(StackName=self.stack_name)
+        with futures.ThreadPoolExecutor(max_workers=min(len(stacks), 10)) as pool:
+            running = {pool.submit(xs.deploy): xs for xs in stacks}
+            for xf in futures.as_completed(running):
+                xf.result()
+
+    def start_teardown(self) -> bool:
+        if self.existing_stack is None:
+            log.warning('Stack %s does not exist. Skipping.', self.stack_name)
+            return False
+        log.info('Deleting stack %s...', self.stack_name_colored)
+        self.cfn.delete_stack(StackName=self.stack_name, ClientRequestToken=f'{self.request_token}-delete')
+        return True
+
+    def finalize_teardown(self) -> None:
         self.wait('stack_delete_complete')
 
+    def teardown(self) -> None:
+        if self.start_teardown():
+            self.finalize_teardown()
+
+    @classmethod
+    def teardown_many(cls, stacks: List[Any]) -> None:
+        # DeleteStack returns immediately, so fire every delete first and only
+        # then wait on the shared poll loop; stacksets keep their own teardown
+        started = list()
+        for xs in stacks:
+            if isinstance(xs, cls):
+                if xs.start_teardown():
+                    started.append(xs)
+            else:
+                xs.teardown()
+        for xs in started:
+            xs.finalize_teardown()
+
+    WAIT_SUCCESS_STATUS = {
+        'stack_create_complete': 'CREATE_COMPLETE',
+        'stack_update_complete': 'UPDATE_COMPLETE',
+        'stack_delete_complete': 'DELETE_COMPLETE'
+    }
+
     def wait(self, event: str) -> None:
         log.info('Waiting for operation to finish...')
-        c = util.session.client('cloudformation')
-        waiter = c.get_waiter(event)
-        try:
-            waiter.wait(StackName=self.stack_name)
-        except Exception as e:
+        waiter = poller.register(self.stack_name)
+        if not waiter['event'].wait(timeout=self.waiter_delay * self.waiter_max_attempts):
+            poller.deregister(self.stack_name, waiter)
+            raise util.DeploymentFailed(f'Stack {self.stack_name} deployment timed out')
+        if waiter['error'] is not None:
+            raise util.DeploymentFailed(f'Stack {self.stack_name} deployment failed: '
+                f'{waiter["error"]}') from waiter['error']
+        if waiter['status'] != self.WAIT_SUCCESS_STATUS[event]:
             self.retrieve()
-            raise util.DeploymentFailed(f'Stack {self.stack_name} deployment failed: {str(e)}') from None
+            raise util.DeploymentFailed(f'Stack {self.stack_name} deployment failed: '
+                f'stack is in status {waiter["status"]}')
 
     def retrieve(self) -> None:
-        r = util.session.resource('cloudformation')
-        self.stack = r.Stack(self.stack_name)
-        log.info(f'Found stack {Fore.GREEN}{self.stack.stack_name}{Style.RESET_ALL} '
-            f'in status {Fore.MAGENTA}{self.stack.stack_status}{Style.RESET_ALL}')
+        # a single DescribeStacks carries the status and the outputs, where the
+        # lazy-loading Stack resource needed an API call per attribute group
+        self.stack = self.cfn.describe_stacks(StackName=self.stack_name)['Stacks'][0]
+        self.stack_outputs = {xo['OutputKey']: xo['OutputValue'] for xo in self.stack.get('Outputs', list())}
+        log.info('Found stack %s in status %s%s%s',
+            self.stack_name_colored, Fore.MAGENTA, self.stack['StackStatus'], Style.RESET_ALL)
@@ -1,13 +1,12 @@
 from cloudformation_seed import util, cfn_template
 
-from typing import Dict, List, Any, Optional, NoReturn
+from typing import Dict, Any, Optional, NoReturn
 
 import logging
-import copy
-import hashlib
-import itertools
+import random
 import time
 
+from concurrent import futures
 from functools import wraps
 from colorama import Fore, Style
 from botocore.exceptions import ClientError
@@ -15,67 +14,94 @@ from botocore.exceptions import ClientError
 log = logging.getLogger('stack-deployer')
 
 
+def overrides_key(overrides):
+    return tuple(sorted((xo['ParameterKey'], xo['ParameterValue']) for xo in overrides))
+
+
+def param_set(params):
+    return frozenset((xp['ParameterKey'], xp.get('ParameterValue')) for xp in params)
+
+
 class StackSetOrganizationRollout(object):
     def __init__(self, stack_name, rollout_config):
         self.stack_name = stack_name
         self.rollout_config = rollout_config
+        self.cfn = util.session.client('cloudformation')
         self.strategy = 'organization'
         self.stack_instances_by_ou = None
+        self.instances_retrieved_at: float = 0.0
+        self.rollout_regions_index: Dict[str, set] = dict()
         self.create_ou = list()
         self.update_ou = list()
         self.delete_ou = list()
+        self.create_ou_index = dict()
+        self.update_ou_index = dict()
 
     def retrieve(self) -> None:
-        c = util.session.client('cloudformation')
+        # deploy() collates both the cleanup and the rollout against the same
+        # instances, a short TTL keeps that to one pagination per deploy
+        if self.stack_instances_by_ou is not None and time.monotonic() - self.instances_retrieved_at < 30:
+            return
+        c = self.cfn
         log.info('Loading stack instances...')
-        r = c.list_stack_instances(StackSetName=self.stack_name)
+        pages = c.get_paginator('list_stack_instances').paginate(
+            StackSetName=self.stack_name, PaginationConfig={'PageSize': 100})
         self.stack_instances_by_ou = dict()
-        for xi in r['Summaries']:
-            if 'OrganizationalUnitId' in xi:
-                self.stack_instances_by_ou.setdefault(xi['OrganizationalUnitId'], set()).add(xi['Region'])
+        for page in pages:
+            for xi in page['Summaries']:
+                if 'OrganizationalUnitId' in xi:
+                    self.stack_instances_by_ou.setdefault(xi['OrganizationalUnitId'], set()).add(xi['Region'])
+        self.instances_retrieved_at = time.monotonic()
         log.info(f'Found {Fore.GREEN}{sum(len(xv) for xv in self.stack_instances_by_ou.values())}{Style.RESET_ALL} '
             f'stack instances in {Fore.MAGENTA}{len(self.stack_instances_by_ou)}{Style.RESET_ALL} OUs')
 
     def find_or_add_ou(self, where, ou):
-        coll = self.create_ou if where == 'create' else self.update_ou
-        matches = [xa for xa in coll if xa['ou'] == ou['ou'] and xa['override'] == ou['override']]
+        coll, index = (self.create_ou, self.create_ou_index) if where == 'create' \
+            else (self.update_ou, self.update_ou_index)
+        key = (ou['ou'], overrides_key(ou['override']))
         try:
-            return matches[0]
-        except IndexError:
-            new_ou = copy.copy(ou)
-            new_ou['regions'] = set()
+            return index[key]
+        except KeyError:
+            new_ou = {**ou, 'regions': set()}
             coll.append(new_ou)
+            index[key] = new_ou
             return new_ou
 
     def ou_region_need_update(self, ou_id, region, overrides):
         return True
 
     def set_create_or_update_ou(self, rollout_item):
+        # partition the regions with set operations instead of branching
+        # per region inside the loop
         ou_id = rollout_item['ou']
-        if ou_id not in self.stack_instances_by_ou and len(rollout_item['regions']) > 0:
-            log.debug(f'Stackset will create instances in OU '
-                f'{Fore.GREEN}{ou_id}{Style.RESET_ALL} regions '
-                f'{Fore.GREEN}{rollout_item["regions"]}{Style.RESET_ALL}')
-            self.create_ou.append(copy.copy(rollout_item))
-            return
-        for region in rollout_item['regions']:
-            if region in self.stack_instances_by_ou[ou_id]:
-                if not self.ou_region_need_update(ou_id, region, rollout_item['override']):
-                    log.info(f'Stack instance in OU '
-                        f'{Fore.GREEN}{ou_id}{Style.RESET_ALL} '
-                        f'region {Fore.GREEN}{region}{Style.RESET_ALL} is not updating')
-                    continue
-                log.debug(f'Stackset will update instance in OU {ou_id} region {region}')
-                rollout_ou = self.find_or_add_ou('update', rollout_item)
-            else:
-                log.debug(f'Stackset will create instance in OU {ou_id} region {region}')
-                rollout_ou = self.find_or_add_ou('create', rollout_item)
-            rollout_ou['regions'].add(region)
+        existing_regions = self.stack_instances_by_ou.get(ou_id, set())
+        to_create = rollout_item['regions'] - existing_regions
+        to_update = set()
+        for region in rollout_item['regions'] & existing_regions:
+            if not self.ou_region_need_update(ou_id, region, rollout_item['override']):
+                log.info('Stack instance in OU %s%s%s region %s%s%s is not updating',
+                    Fore.GREEN, ou_id, Style.RESET_ALL, Fore.GREEN, region, Style.RESET_ALL)
+                continue
+            to_update.add(region)
+        if to_create:
+            log.debug('Stackset will create instances in OU %s%s%s regions %s%s%s',
+                Fore.GREEN, ou_id, Style.RESET_ALL, Fore.GREEN, to_create, Style.RESET_ALL)
+            self.find_or_add_ou('create', rollout_item)['regions'] |= to_create
+        if to_update:
+            log.debug('Stackset will update instances in OU %s%s%s regions %s%s%s',
+                Fore.GREEN, ou_id, Style.RESET_ALL, Fore.GREEN, to_update, Style.RESET_ALL)
+            self.find_or_add_ou('update', rollout_item)['regions'] |= to_update
+
+    @staticmethod
+    def freeze_regions(coll):
+        # freeze the regions into a sorted tuple once so the API call sites
+        # can pass them straight through without list()-ing
+        for xg in coll:
+            xg['regions'] = tuple(sorted(xg['regions']))
+        return coll
 
     def set_delete_ou(self, ou, regions):
-        rollout_ous = [xa for xa in self.rollout_config if xa['ou'] == ou]
-        rollout_regions = set.union(*[xa['regions'] for xa in rollout_ous]) if len(rollout_ous) > 0 else set()
-        delete_regions = regions - rollout_regions
+        delete_regions = regions - self.rollout_regions_index.get(ou, frozenset())
         if len(delete_regions) > 0:
             log.debug(f'OU {ou} is set for deletion in regions {delete_regions}')
             self.delete_ou.append({
@@ -87,102 +113,140 @@ class StackSetOrganizationRollout(object):
     def collate_instances_create_update(self):
         self.create_ou.clear()
         self.update_ou.clear()
+        self.create_ou_index.clear()
+        self.update_ou_index.clear()
         self.retrieve()
         for rollout_item in self.rollout_config:
             self.set_create_or_update_ou(rollout_item)
 
     def collate_instances_delete(self):
         self.delete_ou.clear()
+        self.rollout_regions_index = dict()
+        for xa in self.rollout_config:
+            self.rollout_regions_index.setdefault(xa['ou'], set()).update(xa['regions'])
         self.retrieve()
         for ou, regions in self.stack_instances_by_ou.items():
             self.set_delete_ou(ou, regions)
 
     def rollout_delete(self):
         self.collate_instances_delete()
-        return self.delete_ou
+        return self.freeze_regions(self.delete_ou)
 
     def rollout_create_update(self):
         self.collate_instances_create_update()
-        return self.create_ou, self.update_ou
+        return self.freeze_regions(self.create_ou), self.freeze_regions(self.update_ou)
 
 
 class StackSetRollout(object):
     def __init__(self, stack_name, rollout_config):
         self.stack_name = stack_name
         self.rollout_config = rollout_config
+        self.cfn = util.session.client('cloudformation')
         self.strategy = 'accounts'
         self.stack_instances = None
+        self.instances_retrieved_at: float = 0.0
+        self.rollout_regions_index: Dict[str, set] = dict()
+        self.instance_statuses: Dict[Any, str] = dict()
+        self.instance_probes: Dict[Any, Dict[str, Any]] = dict()
         self.create = list()
         self.update = list()
         self.delete = list()
+        self.create_index = dict()
+        self.update_index = dict()
 
     def retrieve(self) -> None:
-        c = util.session.client('cloudformation')
+        if self.stack_instances is not None and time.monotonic() - self.instances_retrieved_at < 30:
+            return
+        c = self.cfn
         log.info('Loading stack instances...')
-        r = c.list_stack_instances(StackSetName=self.stack_name)
+        pages = c.get_paginator('list_stack_instances').paginate(
+            StackSetName=self.stack_name, PaginationConfig={'PageSize': 100})
         self.stack_instances = dict()
-        for xi in r['Summaries']:
-            self.stack_instances.setdefault(xi['Account'], set()).add(xi['Region'])
+        self.instance_statuses = dict()
+        for page in pages:
+            for xi in page['Summaries']:
+                self.stack_instances.setdefault(xi['Account'], set()).add(xi['Region'])
+                self.instance_statuses[(xi['Account'], xi['Region'])] = xi['Status']
+        self.instances_retrieved_at = time.monotonic()
         log.info(f'Found {Fore.GREEN}{sum(len(xv) for xv in self.stack_instances.values())}{Style.RESET_ALL} '
             f'stack instances in {Fore.MAGENTA}{len(self.stack_instances)}{Style.RESET_ALL} accounts')
 
     def find_or_add_account(self, where, account):
-        coll = self.create if where == 'create' else self.update
-        matches = [xa for xa in coll if xa['account'] == account['account'] and xa['override'] == account['override']]
+        coll, index = (self.create, self.create_index) if where == 'create' else (self.update, self.update_index)
+        key = (account['account'], overrides_key(account['override']))
         try:
-            return matches[0]
-        except IndexError:
-            new_account = copy.copy(account)
-            new_account['regions'] = set()
+            return index[key]
+        except KeyError:
+            new_account = {**account, 'regions': set()}
             coll.append(new_account)
+            index[key] = new_account
             return new_account
 
+    def probe_stack_instances(self) -> None:
+        # overlap the describe_stack_instance round-trips for every existing
+        # (account, region) pair instead of issuing them one at a time
+        c = self.cfn
+        self.instance_probes = dict()
+        pairs = list()
+        for xa in self.rollout_config:
+            existing_regions = self.stack_instances.get(xa['account'], set())
+            # instances with no overrides that the summary already reports as
+            # CURRENT are decided without a describe_stack_instance round-trip
+            pairs.extend((xa['account'], xr) for xr in xa['regions'] & existing_regions
+                if xa['override'] or self.instance_statuses[(xa['account'], xr)] != 'CURRENT')
+        if not pairs:
+            return
+
+        def probe(pair):
+            account_id, region = pair
+            r = c.describe_stack_instance(
+                StackSetName=self.stack_name,
+                StackInstanceAccount=account_id,
+                StackInstanceRegion=region
+            )
+            return pair, r['StackInstance']
+        with futures.ThreadPoolExecutor(max_workers=min(len(pairs), 16)) as pool:
+            for pair, instance in pool.map(probe, pairs):
+                self.instance_probes[pair] = instance
+
     def region_need_update(self, account_id, region, overrides):
-        c = util.session.client('cloudformation')
-        r = c.describe_stack_instance(
-            StackSetName=self.stack_name,
-            StackInstanceAccount=account_id,
-            StackInstanceRegion=region
-        )
-        current_overrides = [{'ParameterKey': xo['ParameterKey'], 'ParameterValue': xo['ParameterValue']}
-            for xo in r['StackInstance']['ParameterOverrides']]
-        if sorted(current_overrides, key=lambda x: x['ParameterKey']) != \
-                sorted(overrides, key=lambda x: x['ParameterKey']):
-            log.info('Parameter overrides are changing in account '
-                f'{Fore.GREEN}{account_id}{Style.RESET_ALL} in region {region}')
+        if not overrides and self.instance_statuses.get((account_id, region)) == 'CURRENT':
+            return False
+        instance = self.instance_probes[(account_id, region)]
+        if param_set(instance['ParameterOverrides']) != param_set(overrides):
+            log.info('Parameter overrides are changing in account %s%s%s in region %s',
+                Fore.GREEN, account_id, Style.RESET_ALL, region)
             return True
-        if r['StackInstance']['Status'] != 'CURRENT':
-            log.info(f'Stackset instance is {Fore.MAGENTA}NOT CURRENT{Style.RESET_ALL} in account '
-                f'{Fore.GREEN}{account_id}{Style.RESET_ALL} in region {region}')
+        if instance['Status'] != 'CURRENT':
+            log.info('Stackset instance is %sNOT CURRENT%s in account %s%s%s in region %s',
+                Fore.MAGENTA, Style.RESET_ALL, Fore.GREEN, account_id, Style.RESET_ALL, region)
             return True
         return False
 
     def set_create_or_update_account(self, account) -> None:
+        # partition the regions with set operations instead of branching
+        # per region inside the loop
         account_id = account['account']
-        if account_id not in self.stack_instances and len(account['regions']) > 0:
-            log.debug(f'Stackset will create instances in account '
-                f'{Fore.GREEN}{account_id}{Style.RESET_ALL} regions '
-                f'{Fore.GREEN}{account["regions"]}{Style.RESET_ALL}')
-            self.create.append(copy.copy(account))
-            return
-        for region in account['regions']:
-            if region in self.stack_instances[account_id]:
-                if not self.region_need_update(account_id, region, account['override']):
-                    log.info(f'Stack instance in account '
-                        f'{Fore.GREEN}{account_id}{Style.RESET_ALL} '
-                        f'region {Fore.GREEN}{region}{Style.RESET_ALL} is not updating')
-                    continue
-                log.debug(f'Stackset will update instance in account {account_id} region {region}')
-                rollout_account = self.find_or_add_account('update', account)
-            else:
-                log.debug(f'Stackset will create instance in account {account_id} region {region}')
-                rollout_account = self.find_or_add_account('create', account)
-            rollout_account['regions'].add(region)
+        existing_regions = self.stack_instances.get(account_id, set())
+        to_create = account['regions'] - existing_regions
+        to_update = set()
+        for region in account['regions'] & existing_regions:
+            if not self.region_need_update(account_id, region, account['override']):
+                log.info('Stack instance in account %s%s%s region %s%s%s is not updating',
+                    Fore.GREEN, account_id, Style.RESET_ALL, Fore.GREEN, region, Style.RESET_ALL)
+                continue
+            to_update.add(region)
+        if to_create:
+            log.debug('Stackset will create instances in account %s%s%s regions %s%s%s',
+                Fore.GREEN, account_id, Style.RESET_ALL, Fore.GREEN, to_create, Style.RESET_ALL)
+            self.find_or_add_account('create', account)['regions'] |= to_create
+        if to_update:
+            log.debug('Stackset will update instances in account %s%s%s regions %s%s%s',
+                Fore.GREEN, account_id, Style.RESET_ALL, Fore.GREEN, to_update, Style.RESET_ALL)
+            self.find_or_add_account('update', account)['regions'] |= to_update
 
     def set_delete_account(self, account, regions):
-        rollout_accounts = [xa for xa in self.rollout_config if xa['account'] == account]
-        rollout_regions = set.union(*[xa['regions'] for xa in rollout_accounts]) if len(rollout_accounts) > 0 else set()
-        delete_regions = regions - rollout_regions
+        delete_regions = regions - self.rollout_regions_index.get(account, frozenset())
         if len(delete_regions) > 0:
             log.debug(f'Account {account} is set for deletion in regions {delete_regions}')
             self.delete.append({
@@ -194,39 +258,22 @@ class StackSetRollout(object):
     def collate_instances_create_update(self):
         self.create.clear()
         self.update.clear()
+        self.create_index.clear()
+        self.update_index.clear()
         self.retrieve()
+        self.probe_stack_instances()
         for rollout_account in self.rollout_config:
             self.set_create_or_update_account(rollout_account)
 
     def collate_instances_delete(self):
         self.delete.clear()
+        self.rollout_regions_index = dict()
+        for xa in self.rollout_config:
+            self.rollout_regions_index.setdefault(xa['account'], set()).update(xa['regions'])
         self.retrieve()
         for account, regions in self.stack_instances.items():
             self.set_delete_account(account, regions)
 
-    def calculate_overrides_checksum(self, account):
-        if len(account['override']) == 0:
-            return '-'
-        sha1sum = hashlib.sha1()
-        for item in sorted(account['override'],
-                key=lambda x: '{ParameterKey}-{ParameterValue}'.format_map(x)):
-            sha1sum.update(bytes(repr(item), 'utf-8'))
-        return sha1sum.hexdigest()
-
-    def rank_sets(self, a):
-        ranking = list()
-        for i in range(len(a), 1, -1):
-            for subset in itertools.combinations(sorted(a), i):
-                intersected = set.intersection(*(a[k] for k in subset))
-                if len(intersected) > 0:
-                    if intersected not in ranking:
-                        ranking.append(intersected)
-                else:
-                    for k in subset:
-                        if a[k] not in ranking:
-                            ranking.append(a[k])
-        return sorted(ranking, reverse=True, key=lambda x: len(x))
-
     def compute_deployment(self, initial, xset):
         new = dict()
         deployment = {
@@ -243,15 +290,14 @@ class StackSetRollout(object):
         return deployment, new
 
     def generate_deployments(self, rollout):
+        # greedy set-cover: only the distinct region signatures present in the
+        # rollout are candidates, scored by accounts covered times regions
+        # served, so grouping stays polynomial in the number of accounts
         while len(rollout) > 1:
-            costed_sets = []
-            for xs in self.rank_sets(rollout):
-                if len(xs) > 0:
-                    d, r0 = self.compute_deployment(rollout, xs)
-                    cost = sum(1 for _ in self.generate_deployments(r0))
-                    costed_sets.append((cost, xs))
-            winner = sorted(costed_sets, key=lambda x: x[0])[0]
-            d, rollout = self.compute_deployment(rollout, winner[1])
+            candidates = {frozenset(xr) for xr in rollout.values()}
+            winner = max(candidates,
+                key=lambda xs: len(xs) * sum(1 for xr in rollout.values() if xr >= xs))
+            d, rollout = self.compute_deployment(rollout, set(winner))
             yield d
         for account, regions in rollout.items():
             yield {
@@ -260,10 +306,13 @@ class StackSetRollout(object):
             }
 
     def grouped_rollout(self, coll):
+        # the groups carry no ordering requirement, so bucket by override key
+        # in one pass instead of sorting just to satisfy groupby
         deployments = list()
-        for _, group in itertools.groupby(sorted(coll, key=self.calculate_overrides_checksum),
-                self.calculate_overrides_checksum):
-            group_list = list(group)
+        buckets = dict()
+        for xd in coll:
+            buckets.setdefault(overrides_key(xd['override']), list()).append(xd)
+        for group_list in buckets.values():
             deployment = {
                 'override': group_list[0]['override'],
                 'accounts': list()
@@ -272,6 +321,9 @@ class StackSetRollout(object):
             for xd in group_list:
                 deployment_accounts.setdefault(xd['account'], set()).update(xd['regions'])
             for xd in self.generate_deployments(deployment_accounts):
+                # freeze the regions into a sorted tuple once so the API call
+                # sites can pass them straight through without list()-ing
+                xd['regions'] = tuple(sorted(xd['regions']))
                 deployment['accounts'].append(xd)
             deployments.append(deployment)
         return deployments
@@ -289,6 +341,7 @@ class CloudformationStackSet(object):
     def __init__(self, installation_name: str, template: cfn_template.CloudformationTemplate) -> None:
         self.template: cfn_template.CloudformationTemplate = template
         self.stack_name: str = f'{installation_name}-{self.template.name}'
+        self.cfn = util.session.client('cloudformation')
         self.stack_parameters: Optional[util.StackParameters] = None
         self.existing_stack: Optional[Dict[str, Any]] = self.find_existing_stackset()
         self.caps = ['CAPABILITY_IAM', 'CAPABILITY_NAMED_IAM', 'CAPABILITY_AUTO_EXPAND']
@@ -297,19 +350,25 @@ class CloudformationStackSet(object):
         self.stack_tags = []
         self.formatted_stack_tags = []
 
+    MAX_PENDING_RETRIES = 10
+
     def retry_pending(f):
         @wraps(f)
         def wrapper(self, *args, **kwargs):
+            attempts = 0
             while True:
                 try:
                     return f(self, *args, **kwargs)
                 except ClientError as e:
-                    if e.response['Error']['Code'] == 'OperationInProgressException':
-                        log.warning(f'Operation is in progress on stackset {self.stack_name}, retrying after wait...')
-                        self.wait_pending_operations()
-                        log.warning('Retrying operation')
-                    else:
+                    if e.response['Error']['Code'] != 'OperationInProgressException':
+                        raise
+                    attempts += 1
+                    if attempts > self.MAX_PENDING_RETRIES:
                         raise
+                    log.warning(f'Operation is in progress on stackset {self.stack_name}, retrying after wait...')
+                    self.wait_pending_operations()
+                    time.sleep(min(2 ** attempts, 30))
+                    log.warning('Retrying operation')
         return wrapper
 
     def set_parameters(self, parameters: util.StackParameters) -> None:
@@ -321,7 +380,8 @@ class CloudformationStackSet(object):
                 self.stackset_rollout = StackSetRollout(self.stack_name, self.stack_parameters.rollout)
 
     def find_existing_stackset(self) -> Optional[Dict[str, Any]]:
-        c = util.session.client('cloudformation')
+        c = self.cfn
+        self.existing_checksum: Optional[str] = None
         try:
             r = c.describe_stack_set(StackSetName=self.stack_name)
             stackset = r['StackSet']
@@ -333,9 +393,9 @@ class CloudformationStackSet(object):
             return None
 
     def tags_need_update(self):
-        c = util.session.client('cloudformation')
-        response = c.describe_stack_set(StackSetName=self.stack_name)
-        return response['StackSet']['Tags'] != self.formatted_stack_tags
+        # the describe_stack_set response held in existing_stack already
+        # carries the tags, no need for another describe call
+        return self.existing_stack['Tags'] != self.formatted_stack_tags
 
     def get_stack_output(self, output_name: str) -> NoReturn:
         raise util.InvalidStackConfiguration(f'Can\'t retrieve output {output_name} '
@@ -343,20 +403,26 @@ class CloudformationStackSet(object):
                                         f', stacksets don\'t have outputs. Please review your configuration')
 
     def format_tags(self, tags_passed):
-        self.formatted_stack_tags = [{'Key': k, 'Value': str(v)} for k, v in tags_passed.items() if v is not None]
+        self.validate_tags(tags_passed)
 
     def validate_tags(self, tags_passed):
+        # validate and format in a single pass over the tags
         self.stack_tags = tags_passed
+        tags_out = list()
         for k, v in tags_passed.items():
+            if v is None:
+                continue
             if len(k) > 127:
                 raise RuntimeError('Tag Key {0} cannot be more than 127 characters long'.format(k))
-            if len(v) > 255:
+            value = str(v)
+            if len(value) > 255:
                 raise RuntimeError('Tag Value {0} cannot be more than 255 characters long'.format(v))
-        self.format_tags(tags_passed)
+            tags_out.append({'Key': k, 'Value': value})
+        self.formatted_stack_tags = tags_out
 
     @retry_pending
     def create_stackset(self) -> None:
-        c = util.session.client('cloudformation')
+        c = self.cfn
         params: Dict[str, Any] = {
             'StackSetName': self.stack_name,
             'TemplateURL': self.template.template_url,
@@ -372,24 +438,27 @@ class CloudformationStackSet(object):
         c.create_stack_set(**params)
         self.wait_pending_operations()
 
+    def existing_template_checksum(self) -> str:
+        # parsing the existing template body is not free, keep the checksum
+        # around until find_existing_stackset refreshes the stackset
+        if self.existing_checksum is None:
+            self.existing_checksum = \
+                cfn_template.CloudformationTemplateBody(self.existing_stack['TemplateBody']).checksum
+        return self.existing_checksum
+
     def stackset_need_update(self) -> bool:
-        current_parameters: List[Dict[str, str]] = \
-            [{'ParameterKey': xo['ParameterKey'], 'ParameterValue': xo['ParameterValue']}
-                for xo in self.existing_stack['Parameters']]
         log.debug('>> Current parameters')
-        log.debug(current_parameters)
+        log.debug(self.existing_stack['Parameters'])
         log.debug('>> New parameters')
         log.debug(self.stack_parameters.format_parameters())
-        parameters_changed: bool = sorted(current_parameters, key=lambda x: x['ParameterKey']) != \
-            sorted(self.stack_parameters.format_parameters(), key=lambda x: x['ParameterKey'])
+        parameters_changed: bool = param_set(self.existing_stack['Parameters']) != \
+            param_set(self.stack_parameters.format_parameters())
         log.info('Parameters are {color}{is_changing}{color_reset} for stackset {color}{stackset_name}{color_reset}'
             .format(is_changing='changing' if parameters_changed else 'not changing',
                 stackset_name=self.stack_name,
                 color=Fore.GREEN,
                 color_reset=Style.RESET_ALL))
-        template_changed: bool = \
-            cfn_template.CloudformationTemplateBody(self.existing_stack['TemplateBody'])\
-                .checksum != self.template.template_checksum
+        template_changed: bool = self.existing_template_checksum() != self.template.template_checksum
         log.info('Template is {color}{is_changing}{color_reset} for stackset {color}{stackset_name}{color_reset}'
             .format(is_changing='changing' if template_changed else 'not changing',
                 stackset_name=self.stack_name,
@@ -409,7 +478,7 @@ class CloudformationStackSet(object):
             log.info('No changes to stackset template or parameters. Skipping stackset update')
             return
         p = self.stack_parameters.format_parameters()
-        c = util.session.client('cloudformation')
+        c = self.cfn
         log.info(f'Updating stackset {Fore.GREEN}{self.stack_name}{Style.RESET_ALL} with template'
             f' {Fore.GREEN}{self.template.template_url}{Style.RESET_ALL}')
         log.debug(' Parameters '.center(48, '-'))
@@ -448,45 +517,93 @@ class CloudformationStackSet(object):
         else:
             self.cleanup_stack_instances()
 
-    @retry_pending
+    def run_stackset_operation(self, api_call, params) -> None:
+        attempts = 0
+        while True:
+            try:
+                api_call(**params)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'OperationInProgressException':
+                    raise
+                attempts += 1
+                if attempts > self.MAX_PENDING_RETRIES:
+                    raise
+                log.warning(f'Operation is in progress on stackset {self.stack_name}, retrying after wait...')
+                self.wait_pending_operations()
+                time.sleep(min(2 ** attempts, 30))
+                log.warning('Retrying operation')
+                continue
+            self.wait_pending_operations()
+            return
+
+    def run_operations(self, operations) -> None:
+        # groups with disjoint targets may run concurrently; colliding ones
+        # raise OperationInProgressException and are retried after a wait in
+        # run_stackset_operation
+        if not operations:
+            return
+        with futures.ThreadPoolExecutor(max_workers=min(len(operations), 4)) as pool:
+            for _ in pool.map(lambda xo: self.run_stackset_operation(*xo), operations):
+                pass
+        if self.stackset_rollout is not None:
+            # the instances have just changed, drop the cached listing
+            self.stackset_rollout.instances_retrieved_at = 0.0
+
+    def ou_instances_params(self, xg) -> Dict[str, Any]:
+        params = {
+            'StackSetName': self.stack_name,
+            'DeploymentTargets': {'OrganizationalUnitIds':
+                xg['ou'] if isinstance(xg['ou'], list) else [xg['ou']]},
+            'Regions': list(xg['regions']) if not isinstance(xg['regions'], tuple) else xg['regions']
+        }
+        if self.stack_parameters.stackset_call_as == 'delegated_admin':
+            params['CallAs'] = 'DELEGATED_ADMIN'
+        params.update(self.stack_parameters.format_operation_preferences())
+        return params
+
+    def account_instances_params(self, xd) -> Dict[str, Any]:
+        params = {
+            'StackSetName': self.stack_name,
+            'Accounts': xd['accounts'],
+            'Regions': list(xd['regions']) if not isinstance(xd['regions'], tuple) else xd['regions']
+        }
+        params.update(self.stack_parameters.format_operation_preferences())
+        return params
+
     def cleanup_organization(self) -> None:
-        c = util.session.client('cloudformation')
         delete_items = self.stackset_rollout.rollout_delete()
-        log.debug(f'Delete instances: {delete_items}')
+        log.debug('Delete instances: %s', delete_items)
+        # delete_stack_instances takes several OUs at once, so OUs sharing
+        # the same region set collapse into a single call
+        delete_batches = dict()
         for xg in delete_items:
-            log.info(f'Deleting stack instances for OU {xg["ou"]} '
-                f'in regions {xg["regions"]}...')
-            params = {
-                'StackSetName': self.stack_name,
-                'DeploymentTargets': {},
-                'Regions': list(xg["regions"]),
-                'RetainStacks': False
-            }
-            params['DeploymentTargets'].setdefault('OrganizationalUnitIds', list()).append(xg['ou'])
-            if self.stack_parameters.stackset_call_as == 'delegated_admin':
-                params['CallAs'] = 'DELEGATED_ADMIN'
-            params.update(self.stack_parameters.format_operation_preferences())
-            c.delete_stack_instances(**params)
-            self.wait_pending_operations()
+            delete_batches.setdefault(frozenset(xg['regions']), list()).append(xg['ou'])
+        operations = list()
+        for regions, ous in delete_batches.items():
+            log.info(f'Deleting stack instances for OUs {ous} '
+                f'in regions {set(regions)}...')
+            params = self.ou_instances_params({'ou': ous, 'regions': regions})
+            params['RetainStacks'] = False
+            operations.append((self.cfn.delete_stack_instances, params))
+        self.run_operations(operations)
 
-    @retry_pending
     def cleanup_stack_instances(self) -> None:
-        c = util.session.client('cloudformation')
         delete_groups = self.stackset_rollout.rollout_delete()
-        log.debug(f'Delete instances: {delete_groups}')
+        log.debug('Delete instances: %s', delete_groups)
+        # accounts sharing the same region set collapse into a single
+        # delete_stack_instances call
+        delete_batches = dict()
         for xg in delete_groups:
             for xd in xg['accounts']:
-                log.info(f'Deleting stack instances for accounts {xd["accounts"]} '
-                    f'in regions {xd["regions"]}...')
-                params = {
-                    'StackSetName': self.stack_name,
-                    'Accounts': xd["accounts"],
-                    'Regions': list(xd["regions"]),
-                    'RetainStacks': False
-                }
-                params.update(self.stack_parameters.format_operation_preferences())
-                c.delete_stack_instances(**params)
-                self.wait_pending_operations()
+                delete_batches.setdefault(frozenset(xd['regions']), list()).extend(xd['accounts'])
+        operations = list()
+        for regions, accounts in delete_batches.items():
+            log.info(f'Deleting stack instances for accounts {accounts} '
+                f'in regions {set(regions)}...')
+            params = self.account_instances_params({'accounts': accounts, 'regions': regions})
+            params['RetainStacks'] = False
+            operations.append((self.cfn.delete_stack_instances, params))
+        self.run_operations(operations)
 
     def rollout_stackset(self):
         if self.stackset_rollout is None:
@@ -499,7 +616,7 @@ class CloudformationStackSet(object):
 
     def check_stack_instances(self):
         failures = []
-        c = util.session.client('cloudformation')
+        c = self.cfn
         for page in c.get_paginator('list_stack_instances').paginate(StackSetName=self.stack_name):
             for summary in page['Summaries']:
                 if summary['Status'] in ['OUTDATED', 'INOPERABLE']:
@@ -513,83 +630,55 @@ class CloudformationStackSet(object):
                 log.error(f'Reason: {fail["StatusReason"]}')
             raise util.DeploymentFailed(f'Stackset {self.stack["StackSetName"]} has {len(failures)} failed instances.')
 
-    @retry_pending
     def rollout_organization(self) -> None:
-        c = util.session.client('cloudformation')
         create_items, update_items = self.stackset_rollout.rollout_create_update()
-        log.debug(f'Update instances: {update_items}')
-        log.debug(f'Create instances: {create_items}')
+        log.debug('Update instances: %s', update_items)
+        log.debug('Create instances: %s', create_items)
+        operations = list()
         for xg in create_items:
-            params = {
-                'StackSetName': self.stack_name,
-                'DeploymentTargets': {},
-                'Regions': list(xg["regions"]),
-                'ParameterOverrides': xg['override']
-            }
             log.info(f'Creating new stack instances for OU {xg["ou"]} '
                 f'in regions {xg["regions"]}...')
-            params['DeploymentTargets'].setdefault('OrganizationalUnitIds', list()).append(xg['ou'])
-            if self.stack_parameters.stackset_call_as == 'delegated_admin':
-                params['CallAs'] = 'DELEGATED_ADMIN'
-            params.update(self.stack_parameters.format_operation_preferences())
-            c.create_stack_instances(**params)
-            self.wait_pending_operations()
+            params = self.ou_instances_params(xg)
+            params['ParameterOverrides'] = xg['override']
+            operations.append((self.cfn.create_stack_instances, params))
         for xg in update_items:
-            params = {
-                'StackSetName': self.stack_name,
-                'DeploymentTargets': {},
-                'Regions': list(xg["regions"]),
-                'ParameterOverrides': xg['override']
-            }
             log.info(f'Updating stack instances for OU {xg["ou"]} '
                 f'in regions {xg["regions"]}...')
-            params['DeploymentTargets'].setdefault('OrganizationalUnitIds', list()).append(xg['ou'])
-            if self.stack_parameters.stackset_call_as == 'delegated_admin':
-                params['CallAs'] = 'DELEGATED_ADMIN'
-            params.update(self.stack_parameters.format_operation_preferences())
-            c.update_stack_instances(**params)
-            self.wait_pending_operations()
+            params = self.ou_instances_params(xg)
+            params['ParameterOverrides'] = xg['override']
+            operations.append((self.cfn.update_stack_instances, params))
+        self.run_operations(operations)
 
-    @retry_pending
     def rollout_accounts(self) -> None:
-        c = util.session.client('cloudformation')
         create_groups, update_groups = self.stackset_rollout.rollout_create_update()
-        log.debug(f'Update instances: {update_groups}')
-        log.debug(f'Create instances: {create_groups}')
+        log.debug('Update instances: %s', update_groups)
+        log.debug('Create instances: %s', create_groups)
+        operations = list()
         for xg in create_groups:
             for xd in xg['accounts']:
                 log.info(f'Creating new stack instances for accounts {xd["accounts"]} '
                     f'in regions {xd["regions"]}...')
-                params = {
-                    'StackSetName': self.stack_name,
-                    'Accounts': xd["accounts"],
-                    'Regions': list(xd["regions"]),
-                    'ParameterOverrides': xg['override']
-                }
-                params.update(self.stack_parameters.format_operation_preferences())
-                c.create_stack_instances(**params)
-                self.wait_pending_operations()
+                params = self.account_instances_params(xd)
+                params['ParameterOverrides'] = xg['override']
+                operations.append((self.cfn.create_stack_instances, params))
         for xg in update_groups:
             for xd in xg['accounts']:
                 log.info(f'Updating stack instances for accounts {xd["accounts"]} '
                     f'in regions {xd["regions"]}...')
-                params = {
-                    'StackSetName': self.stack_name,
-                    'Accounts': xd["accounts"],
-                    'Regions': list(xd["regions"]),
-                    'ParameterOverrides': xg['override']
-                }
-                params.update(self.stack_parameters.format_operation_preferences())
-                c.update_stack_instances(**params)
-                self.wait_pending_operations()
+                params = self.account_instances_params(xd)
+                params['ParameterOverrides'] = xg['override']
+                operations.append((self.cfn.update_stack_instances, params))
+        self.run_operations(operations)
 
     @retry_pending
     def wipe_out_stackset_instances(self) -> None:
-        c = util.session.client('cloudformation')
-        i = c.list_stack_instances(StackSetName=self.stack_name)
-        for account, group in itertools.groupby(sorted(i['Summaries'],
-                key=lambda x: x['Account']), lambda x: x['Account']):
-            regions = [xg['Region'] for xg in group]
+        c = self.cfn
+        summaries = [xi for page in c.get_paginator('list_stack_instances').paginate(
+            StackSetName=self.stack_name, PaginationConfig={'PageSize': 100}) for xi in page['Summaries']]
+        instance_regions = dict()
+        for xi in summaries:
+            instance_regions.setdefault(xi['Account'], list()).append(xi['Region'])
+        for account, regions in instance_regions.items():
             log.info(f'Deleting stack instance in account {account} regions {regions}...')
             c.delete_stack_instances(
                 StackSetName=self.stack_name,
@@ -604,7 +693,7 @@ class CloudformationStackSet(object):
 
     @retry_pending
     def delete_stackset(self) -> None:
-        c = util.session.client('cloudformation')
+        c = self.cfn
         log.info(f'Deleting stackset {self.stack_name}...')
         c.delete_stack_set(StackSetName=self.stack_name)
 
@@ -616,14 +705,19 @@ class CloudformationStackSet(object):
         self.delete_stackset()
 
     def wait_pending_operations(self) -> None:
-        c = util.session.client('cloudformation')
+        # operations come back newest-first, so the first summary is the one
+        # we just started; back off exponentially with jitter instead of a
+        # fixed 10s so short operations converge fast and long ones poll less
+        c = self.cfn
+        delay = 2
         try:
             time.sleep(1)
             while True:
-                r = c.list_stack_set_operations(StackSetName=self.stack_name, MaxResults=10)
-                if len([xo for xo in r['Summaries'] if xo['Status'] in ['RUNNING', 'STOPPING']]) > 0:
+                r = c.list_stack_set_operations(StackSetName=self.stack_name, MaxResults=1)
+                if r['Summaries'] and r['Summaries'][0]['Status'] in ('RUNNING', 'STOPPING'):
                     log.info(f'There\'s operations pending on stackset {self.stack_name}')
-                    time.sleep(10)
+                    time.sleep(delay * (0.8 + 0.4 * random.random()))
+                    delay = min(delay * 1.5, 30)
                     continue
                 return
         except ClientError as e:
@@ -1,30 +1,65 @@
 from cloudformation_seed import s3_classes, util
 
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Optional, Tuple
 from colorama import Fore, Style
 
+import functools
+import mmap
 import os
+import pickle
+from concurrent import futures
 import yaml
 import hashlib
 import logging
 
 log = logging.getLogger('stack-deployer')
 
+CACHE_DIR = '.cfnseed-cache'
+
 
 class CloudformationTemplateBody:
-    def __init__(self, template_text: str) -> None:
-        self.text = template_text
-        self.checksum = self.calculate_checksum(self.text)
+    def __init__(self, template_text: Any, checksum: Optional[str] = None) -> None:
+        # template_text may be a str, bytes or an mmap-ed buffer; yaml reads
+        # any of them and only the str form needs encoding for the digest
+        self.checksum = checksum or hashlib.sha1(template_text.encode('utf-8')).hexdigest()
         self.body: Dict[str, Any] = yaml.load(template_text, Loader=util.IgnoreYamlLoader)
 
     @property
     def parameters(self) -> Dict[str, Dict[str, str]]:
         return self.body.get('Parameters', dict())
 
-    def calculate_checksum(self, text) -> str:
-        sha1sum = hashlib.sha1()
-        sha1sum.update(bytes(self.text, 'utf-8'))
-        return sha1sum.hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def load_template_body(file_path: str) -> CloudformationTemplateBody:
+    # the same physical template can back several stacks; parse and hash each
+    # file exactly once and share the immutable body between them. A pickle
+    # cache keyed on mtime and size carries the parsed body across runs, so
+    # warm deploys skip yaml parsing altogether
+    st = os.stat(file_path)
+    cache_path = os.path.join(CACHE_DIR, f'{hashlib.sha1(file_path.encode("utf-8")).hexdigest()}.pkl')
+    try:
+        with open(cache_path, 'rb') as f:
+            mtime_ns, size, body = pickle.load(f)
+        if (mtime_ns, size) == (st.st_mtime_ns, st.st_size):
+            return body
+    except (OSError, pickle.PickleError, EOFError, ValueError):
+        pass
+    with open(file_path, 'rb') as f:
+        if st.st_size > 0:
+            # hash and parse straight off the page cache instead of copying
+            # the whole file into an interpreter-side buffer first
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                body = CloudformationTemplateBody(mm, hashlib.sha1(mm).hexdigest())
+        else:
+            data = f.read()
+            body = CloudformationTemplateBody(data, hashlib.sha1(data).hexdigest())
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(cache_path, 'wb') as f:
+            pickle.dump((st.st_mtime_ns, st.st_size, body), f)
+    except (OSError, pickle.PickleError):
+        log.debug('Could not write template cache for %s', file_path)
+    return body
 
 
 class CloudformationTemplate(object):
@@ -37,7 +72,8 @@ class CloudformationTemplate(object):
             generated_key = self.build_s3_key(self.template_key, self.template_checksum)
             self.s3_key = f'{s3_key_prefix}/{generated_key}'
             self.o: s3_classes.S3Uploadable = \
-                s3_classes.S3Uploadable(file_path, s3_bucket, self.s3_key)
+                s3_classes.S3Uploadable(file_path, s3_bucket, self.s3_key, s3_key_prefix=s3_key_prefix,
+                    skip_etag_check=self.template_parameters.get('predictable_name', False) is not True)
         elif template_key.startswith("s3://"):
             r = util.session.resource('s3')
             s3_bucket_name, self.s3_key = template_key.replace("s3://", "").split("/", 1)
@@ -85,8 +121,7 @@ class CloudformationTemplate(object):
     def load_template_file(self, file_path: str) -> CloudformationTemplateBody:
         log.info(f'Loading template for stack {Fore.GREEN}{self.name}{Style.RESET_ALL} '
             f'from {Fore.GREEN}{file_path}{Style.RESET_ALL}...')
-        with open(file_path, 'r') as f:
-            return CloudformationTemplateBody(f.read())
+        return load_template_body(file_path)
 
     def sync(self) -> None:
         if self.o and isinstance(self.o, s3_classes.S3Uploadable):
@@ -102,8 +137,12 @@ class CloudformationCollection(util.DirectoryScanner):
         self.s3_bucket: Any = s3_bucket
         self.environment_parameters: Dict['str', Any] = environment_parameters
         self.template_files: List[Tuple[str, str]] = self.scan_directories(path, '**/*.cf.yaml')
+        self.template_file_index: Dict[str, str] = dict(self.template_files)
         util.log_section('Collecting templates included in the environment')
         self.templates: List[CloudformationTemplate] = []
+        self.templates_by_key: Dict[str, CloudformationTemplate] = dict()
+        self.templates_by_name: Dict[str, CloudformationTemplate] = dict()
+        self.templates_by_template: Dict[str, CloudformationTemplate] = dict()
         for xs in self.environment_parameters.get('stacks', list()):
             template_key = xs['template']
             # use s3 path
@@ -124,13 +163,13 @@ class CloudformationCollection(util.DirectoryScanner):
                     self.find_template_file(template_key),
                     xs
                 )
-            self.templates.append(template)
+            self.add_template(template)
 
         util.log_section('Collecting templates not included in the environment')
         for xf in self.template_files:
-            if len([xt for xt in self.templates if xt.template_key == xf[0]]) > 0:
+            if xf[0] in self.templates_by_key:
                 continue
-            self.templates.append(CloudformationTemplate(
+            self.add_template(CloudformationTemplate(
                 self.s3_bucket,
                 xf[0],
                 s3_key_prefix,
@@ -142,6 +181,14 @@ class CloudformationCollection(util.DirectoryScanner):
             )
         util.log_section('Done collecting templates')
 
+    def add_template(self, template: CloudformationTemplate) -> None:
+        # the indexes keep the last template registered under a key, matching
+        # what the .pop() on a linear scan used to return
+        self.templates.append(template)
+        self.templates_by_key[template.template_key] = template
+        self.templates_by_name[template.name] = template
+        self.templates_by_template[template.template] = template
+
     def list_deployable(self) -> List[CloudformationTemplate]:
         u = list()
         for xs in self.environment_parameters.get('stacks', list()):
@@ -149,26 +196,36 @@ class CloudformationCollection(util.DirectoryScanner):
                 if xs.get('deployable', True) is False:
                     log.info(f'Stack {Fore.GREEN}{xs.get("name")}{Style.RESET_ALL} is not deployable, skipping')
                     continue
-                stack_template = [xt for xt in self.templates if xt.name == xs.get('name')].pop()
-                u.append(stack_template)
-            except IndexError:
+                u.append(self.templates_by_name[xs.get('name')])
+            except KeyError:
                 raise util.InvalidStackConfiguration(f'Template not found for {xs.get("name")}') from None
         return u
 
     def find_template(self, template_name: str) -> CloudformationTemplate:
         try:
-            return [x for x in self.templates if x.template == template_name].pop()
-        except IndexError:
+            return self.templates_by_template[template_name]
+        except KeyError:
             raise util.InvalidStackConfiguration(f'Template {template_name} not found in this deployment')\
                 from None
 
     def find_template_file(self, template_key: str) -> str:
-        for xk, xp in self.template_files:
-            if xk == template_key:
-                return xp
-        raise util.InvalidStackConfiguration(f'Template file not found for {template_key}')
+        try:
+            return self.template_file_index[template_key]
+        except KeyError:
+            raise util.InvalidStackConfiguration(f'Template file not found for {template_key}') from None
 
     def sync(self) -> None:
-        for xt in [xt for n, xt in enumerate(self.templates)
-                        if xt.template not in [xxt.template for xxt in self.templates[:n]]]:
-            xt.sync()
+        seen = set()
+        to_sync = list()
+        for xt in self.templates:
+            if xt.template in seen:
+                continue
+            seen.add(xt.template)
+            to_sync.append(xt)
+        if not to_sync:
+            return
+        # uploads and downloads are independent per template
+        with futures.ThreadPoolExecutor(max_workers=min(len(to_sync), 16)) as pool:
+            running = {pool.submit(xt.sync): xt for xt in to_sync}
+            for xf in futures.as_completed(running):
+                xf.result()
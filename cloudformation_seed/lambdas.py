@@ -1,10 +1,12 @@
-from typing import Any, Optional
+from typing import Any, Dict, Optional, Tuple
 from typing import List
 
 from cloudformation_seed import s3_classes, util
 
+import struct
 import zipfile
 import subprocess
+from concurrent import futures
 import logging
 
 import os
@@ -13,6 +15,10 @@ from colorama import Fore, Style
 
 log = logging.getLogger('stack-deployer')
 
+# zip checksums keyed by path and stat identity survive re-runs within the
+# process, so a zip that make left untouched is never re-parsed
+_zip_checksums: Dict[Tuple[str, int, int], str] = dict()
+
 
 class LambdaFunction(object):
     def __init__(self, path: str, s3_bucket: Any, s3_key_prefix: str) -> None:
@@ -28,22 +34,32 @@ class LambdaFunction(object):
         return self.u.s3_key
 
     def find_lambda_zipfile(self) -> str:
-        log.debug(f'Looking for zipfile in {self.path}')
-        for xf in os.listdir(self.path):
-            if xf.endswith('.zip'):
-                log.debug(f'Finally {xf} looks like a zip file')
-                return xf
-            log.debug(f'{xf} is not a zip file')
+        log.debug('Looking for zipfile in %s', self.path)
+        with os.scandir(self.path) as entries:
+            for xf in entries:
+                if xf.is_file() and xf.name.endswith('.zip'):
+                    log.debug('Finally %s looks like a zip file', xf.name)
+                    return xf.name
         raise util.InvalidStackConfiguration(f'Lambda function source at {self.path} must produce a zipfile')
 
     def checksum_zipfile(self) -> str:
-        sha1sum = hashlib.sha1()
-        with zipfile.ZipFile(os.path.join(self.path, self.zip_file), 'r') as f:
-            for xc in sorted([xf.CRC for xf in f.filelist]):
-                sha1sum.update(xc.to_bytes((xc.bit_length() + 7) // 8, 'big') or b'\0')
-        return sha1sum.hexdigest()
-
-    def prepare(self) -> None:
+        zip_path = os.path.join(self.path, self.zip_file)
+        st = os.stat(zip_path)
+        cache_key = (zip_path, st.st_mtime_ns, st.st_size)
+        digest = _zip_checksums.get(cache_key)
+        if digest is not None:
+            return digest
+        # the key must be stable across rebuilds, so hash the member CRCs
+        # rather than the raw zip bytes, which churn with every timestamp;
+        # CRC32s are 32 bits, one struct.pack encodes them all at fixed width.
+        # infolist comes off the central directory, no member is decompressed
+        with zipfile.ZipFile(zip_path, 'r') as f:
+            crcs = sorted(xf.CRC for xf in f.filelist)
+        digest = _zip_checksums[cache_key] = \
+            hashlib.sha1(struct.pack(f'>{len(crcs)}I', *crcs)).hexdigest()
+        return digest
+
+    def run_make(self) -> None:
         log.info(f'Running make in {Fore.GREEN}{self.path}{Style.RESET_ALL}...')
         try:
             m = subprocess.run(['make'], check=True, cwd=self.path, stdout=subprocess.PIPE,
@@ -59,10 +75,17 @@ class LambdaFunction(object):
             log.error('-' * 64)
             log.error('Aborting deployment')
             raise util.DeploymentFailed(f'Make failed in {self.path}') from None
+
+    def collect(self) -> None:
         self.zip_file = self.find_lambda_zipfile()
         self.zip_checksum = self.checksum_zipfile()
         self.u = s3_classes.S3Uploadable(os.path.join(self.path, self.zip_file), self.s3_bucket,
-            f'{self.s3_key_prefix}/{self.zip_checksum}-{self.zip_file}', self.zip_checksum)
+            f'{self.s3_key_prefix}/{self.zip_checksum}-{self.zip_file}', self.zip_checksum,
+            s3_key_prefix=self.s3_key_prefix)
+
+    def prepare(self) -> None:
+        self.run_make()
+        self.collect()
 
     def upload(self) -> None:
         self.u.upload()
@@ -74,26 +97,90 @@ class LambdaFunction(object):
 
 class LambdaCollection(object):
     def __init__(self, path: str, s3_bucket: Any, s3_key_prefix: str) -> None:
+        self.path: str = path
         self.s3_bucket: Any = s3_bucket
         self.lambdas: List[LambdaFunction] = list()
         if os.path.isdir(path):
-            self.lambdas = [LambdaFunction(os.path.join(path, x), self.s3_bucket, s3_key_prefix)
-                        for x in os.listdir(path) if os.access(os.path.join(path, x, 'Makefile'), os.R_OK)]
+            # scandir batches the stat information with the directory read
+            with os.scandir(path) as entries:
+                self.lambdas = [LambdaFunction(xe.path, self.s3_bucket, s3_key_prefix)
+                            for xe in entries
+                            if xe.is_dir() and os.access(os.path.join(xe.path, 'Makefile'), os.R_OK)]
+        self.lambdas_by_zip: Dict[str, LambdaFunction] = dict()
+
+    def run_many(self, method_name: str) -> None:
+        # each lambda runs make in its own directory, so the external
+        # processes are independent and can overlap
+        if not self.lambdas:
+            return
+        with futures.ThreadPoolExecutor(max_workers=min(len(self.lambdas), os.cpu_count() or 4)) as pool:
+            running = {pool.submit(getattr(x, method_name)): x for x in self.lambdas}
+            for xf in futures.as_completed(running):
+                xf.result()
+
+    def toplevel_make_targets(self) -> bool:
+        # only trust a toplevel Makefile that carries a rule per lambda
+        # directory; one kept for unrelated housekeeping must not hijack
+        # the per-directory builds. make -qp dumps the rule database
+        # without running anything, and a directory that merely exists
+        # shows up under a '# Not a target:' marker
+        if not os.access(os.path.join(self.path, 'Makefile'), os.R_OK):
+            return False
+        r = subprocess.run(['make', '-qp'], cwd=self.path, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, encoding='utf-8')
+        targets = set()
+        previous = ''
+        for line in r.stdout.splitlines():
+            if line and not line.startswith(('#', '\t', ' ', '.')) \
+                    and ':' in line and previous != '# Not a target:':
+                name = line.split(':', 1)[0]
+                if '=' not in name:
+                    targets.add(name.strip())
+            previous = line
+        missing = [os.path.basename(x.path) for x in self.lambdas
+            if os.path.basename(x.path) not in targets]
+        if missing:
+            log.debug('Toplevel Makefile has no target for %s, building per directory', ', '.join(missing))
+            return False
+        return True
+
+    def run_toplevel_make(self) -> None:
+        log.info(f'Running toplevel make in {Fore.GREEN}{self.path}{Style.RESET_ALL}...')
+        targets = [os.path.basename(x.path) for x in self.lambdas]
+        try:
+            m = subprocess.run(['make', '-j', str(os.cpu_count() or 4)] + targets, check=True, cwd=self.path,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding='utf-8')
+            log.debug('Make output will follow:')
+            log.debug('-' * 64)
+            log.debug(m.stdout)
+            log.debug('-' * 64)
+        except subprocess.CalledProcessError as e:
+            log.error(f'Make failed in {self.path}, make output will follow:')
+            log.error('-' * 64)
+            log.error(e.stdout)
+            log.error('-' * 64)
+            log.error('Aborting deployment')
+            raise util.DeploymentFailed(f'Make failed in {self.path}') from None
 
     def prepare(self) -> None:
-        for x in self.lambdas:
-            x.prepare()
+        if self.lambdas and self.toplevel_make_targets():
+            # a toplevel Makefile with a target per lambda directory drives
+            # every build through make's own -j scheduler in one process
+            self.run_toplevel_make()
+            self.run_many('collect')
+        else:
+            self.run_many('prepare')
+        # zip file names only exist after make has run, index them here
+        self.lambdas_by_zip = {x.zip_file: x for x in self.lambdas}
 
     def upload(self) -> None:
-        for x in self.lambdas:
-            x.upload()
+        self.run_many('upload')
 
     def cleanup(self) -> None:
-        for x in self.lambdas:
-            x.cleanup()
+        self.run_many('cleanup')
 
     def find_lambda_key(self, zip_name) -> str:
         try:
-            return [x.s3_key for x in self.lambdas if x.zip_file == zip_name].pop()
-        except IndexError:
+            return self.lambdas_by_zip[zip_name].s3_key
+        except KeyError:
             raise util.InvalidStackConfiguration(f'Lambda function bundle {zip_name} not found') from None
@@ -2,16 +2,65 @@ from typing import Any, Optional
 
 from cloudformation_seed import util
 
+import functools
 import os
 import tempfile
 import hashlib
 import logging
+import threading
 
+from concurrent import futures
+from boto3.s3.transfer import TransferConfig
 from colorama import Fore, Style
 from botocore.exceptions import ClientError
 
 log = logging.getLogger('stack-deployer')
 
+# large objects go up as parallel multipart segments, the transfer manager
+# threads are safe to share between uploads
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=10, use_threads=True)
+
+
+@functools.lru_cache(maxsize=1)
+def s3_endpoint_url() -> str:
+    # building a boto3 client resolves config and endpoints every time,
+    # the URL cannot change mid-run
+    return util.cached_client('s3').meta.endpoint_url
+
+
+_bucket_listings: dict = dict()
+_bucket_listings_lock = threading.Lock()
+
+
+def bucket_etags(s3_bucket, prefix: str) -> dict:
+    # one LIST per bucket prefix replaces a HeadObject per uploaded file
+    key = (s3_bucket.name, prefix)
+    with _bucket_listings_lock:
+        if key not in _bucket_listings:
+            _bucket_listings[key] = {xo.key: xo.e_tag.strip('"')
+                for xo in s3_bucket.objects.filter(Prefix=prefix)}
+        return _bucket_listings[key]
+
+
+def upload_many(uploadables) -> None:
+    # each upload is a network round-trip, overlap them instead of paying
+    # the sum of the latencies
+    if len(uploadables) == 1:
+        uploadables[0].upload()
+        return
+    if not uploadables:
+        return
+    with futures.ThreadPoolExecutor(max_workers=min(len(uploadables), 16)) as pool:
+        running = {pool.submit(xu.upload): xu for xu in uploadables}
+        # stop on the first failure instead of pushing the rest of the queue
+        # up to S3 just to throw the run away
+        done, not_done = futures.wait(running, return_when=futures.FIRST_EXCEPTION)
+        for xf in not_done:
+            xf.cancel()
+        for xf in done:
+            xf.result()
+
 
 class S3Downloadble(object):
     def __init__(self, s3_bucket: Any, s3_key: str, local_path: Optional[str] = None) -> None:
@@ -29,39 +78,75 @@ class S3Downloadble(object):
 
     @property
     def s3_url(self):
-        return f'{util.session.client("s3").meta.endpoint_url}/{self.s3_bucket.name}/{self.s3_key}'
+        return f'{s3_endpoint_url()}/{self.s3_bucket.name}/{self.s3_key}'
 
 
 class S3Uploadable(object):
-    def __init__(self, file_path: str, s3_bucket: Any, s3_key: str, object_checksum: Optional[str] = None) -> None:
+    def __init__(self, file_path: str, s3_bucket: Any, s3_key: str, object_checksum: Optional[str] = None,
+                    s3_key_prefix: Optional[str] = None, skip_etag_check: bool = False) -> None:
         self.file_path: str = file_path
-        self.file_checksum: str = object_checksum or self.calculate_md5(self.file_path)
+        self.object_checksum: Optional[str] = object_checksum
+        self.computed_checksum: Optional[str] = None
         self.s3_bucket: Any = s3_bucket
         self.s3_key: str = s3_key
+        self.s3_key_prefix: Optional[str] = s3_key_prefix
+        self.skip_etag_check: bool = skip_etag_check
         self.bytes: int = 0
         self.total_bytes: int = os.path.getsize(self.file_path)
 
+    @property
+    def file_checksum(self) -> str:
+        # computing the MD5 lazily keeps teardowns and skipped uploads from
+        # hashing files whose checksum is never looked at
+        if self.object_checksum:
+            return self.object_checksum
+        if self.computed_checksum is None:
+            self.computed_checksum = self.calculate_md5(self.file_path)
+        return self.computed_checksum
+
     def calculate_md5(self, file_path: str) -> str:
-        md5sum = hashlib.md5()
         with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(65535), b''):
+            if hasattr(hashlib, 'file_digest'):
+                # hashes in C with the GIL released, available from Python 3.11
+                return hashlib.file_digest(f, 'md5').hexdigest()
+            md5sum = hashlib.md5()
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
                 md5sum.update(chunk)
         return md5sum.hexdigest()
 
     def print_progress(self, current_bytes: int) -> None:
         self.bytes += current_bytes
-        log.debug(f'{self.bytes} bytes out of {self.total_bytes} complete')
+        log.debug('%d bytes out of %d complete', self.bytes, self.total_bytes)
 
     def verify_existing_checksum(self) -> bool:
         etag: str = ''
         object_key: str = ''
-        o = self.s3_bucket.Object(self.s3_key)
-        try:
-            etag = o.e_tag.strip('"')
-            object_key = o.key
-        except ClientError:
-            log.debug(f'{self.s3_key} doesn\'t seem to exist in the bucket')
-            return False
+        if self.s3_key_prefix is not None:
+            etag = bucket_etags(self.s3_bucket, self.s3_key_prefix).get(self.s3_key, '')
+            if not etag:
+                log.debug(f'{self.s3_key} doesn\'t seem to exist in the bucket')
+                return False
+            object_key = self.s3_key
+        elif self.skip_etag_check:
+            o = self.s3_bucket.Object(self.s3_key)
+            try:
+                o.load()
+            except ClientError:
+                log.debug(f'{self.s3_key} doesn\'t seem to exist in the bucket')
+                return False
+        else:
+            o = self.s3_bucket.Object(self.s3_key)
+            try:
+                etag = o.e_tag.strip('"')
+                object_key = o.key
+            except ClientError:
+                log.debug(f'{self.s3_key} doesn\'t seem to exist in the bucket')
+                return False
+        if self.skip_etag_check:
+            # the key embeds the content checksum, so an existing object is
+            # by construction identical and the local file never gets hashed
+            log.debug(f'Object {self.s3_key} exists, not comparing checksums')
+            return True
         if self.file_checksum in object_key:
             log.debug(f'Object name {self.s3_key} contains checksum {self.file_checksum}')
             return True
@@ -77,11 +162,15 @@ class S3Uploadable(object):
             return
         log.info(f'Uploading {Fore.GREEN}{self.file_path}{Style.RESET_ALL} '
             f'into {Fore.GREEN}{self.s3_url}{Style.RESET_ALL}')
-        self.s3_bucket.upload_file(self.file_path, self.s3_key, Callback=self.print_progress)
+        # the transfer manager fires the callback per chunk; skip the Python
+        # round-trips entirely unless someone is watching at DEBUG
+        callback = self.print_progress if log.isEnabledFor(logging.DEBUG) else None
+        self.s3_bucket.upload_file(self.file_path, self.s3_key, Callback=callback,
+            Config=TRANSFER_CONFIG)
 
     @property
     def s3_url(self):
-        return f'{util.session.client("s3").meta.endpoint_url}/{self.s3_bucket.name}/{self.s3_key}'
+        return f'{s3_endpoint_url()}/{self.s3_bucket.name}/{self.s3_key}'
 
 
 class S3RecursiveUploader(util.DirectoryScanner):
@@ -89,9 +178,8 @@ class S3RecursiveUploader(util.DirectoryScanner):
         self.s3_bucket: Any = s3_bucket
         self.s3_key_prefix: str = s3_key_prefix
         log.info(f'Scanning files in {Fore.GREEN}{path}{Style.RESET_ALL}...')
-        self.u = [S3Uploadable(f, self.s3_bucket, f'{self.s3_key_prefix}/{k}')
+        self.u = [S3Uploadable(f, self.s3_bucket, f'{self.s3_key_prefix}/{k}', s3_key_prefix=self.s3_key_prefix)
             for k, f in self.scan_directories(path)]
 
     def upload(self) -> None:
-        for xu in self.u:
-            xu.upload()
+        upload_many(self.u)
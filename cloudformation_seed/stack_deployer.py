@@ -2,13 +2,13 @@
 from datetime import datetime
 from cloudformation_seed import util, s3_classes, lambdas, cfn_template, cfn_stack, cfn_stackset
 
+import json
 import yaml
 import os
 import argparse
 import logging
 import sys
 from colorama import init as init_colorama, Fore, Style
-from string import Template
 from botocore.exceptions import ClientError
 from .version import VERSION
 
@@ -32,6 +32,7 @@ class StackParser(object):
         self.templates_prefix = options.templates_prefix
 
         self.stacks = self.setup_stacks()
+        self.stacks_by_name = {xs.template.name: xs for xs in self.stacks}
 
     def setup_stacks(self):
         stacks = list()
@@ -46,31 +47,92 @@ class StackParser(object):
 
     def find_stack_output(self, stack_name, output_name):
         try:
-            return [xs.get_stack_output(output_name) for xs in self.stacks if xs.template.name == stack_name].pop()
-        except IndexError:
+            return self.stacks_by_name[stack_name].get_stack_output(output_name)
+        except KeyError:
             raise util.InvalidStackConfiguration(f'Can\'t find output {output_name} on stack {stack_name}, '
                         f'template {stack_name} is not part of the deployment') from None
 
     def find_template(self, template_name):
-        try:
-            return [f'{xt.s3_key_prefix}/{xt.s3_key}' for xt in self.templates if xt.s3_key == template_name].pop()
-        except IndexError:
+        t = next((xt for xt in self.templates if xt.s3_key == template_name), None)
+        if t is None:
             raise util.InvalidStackConfiguration(f'Template {template_name} is not part of the deployment')\
                 from None
+        return f'{t.s3_key_prefix}/{t.s3_key}'
+
+    def collect_stack_outputs(self, node):
+        deps = set()
+
+        def walk(node):
+            if isinstance(node, yaml.ScalarNode):
+                if node.tag == '!StackOutput':
+                    deps.add(node.value.split('.')[0])
+            elif isinstance(node, yaml.CollectionNode):
+                walk(node.value)
+            elif isinstance(node, dict):
+                for xv in node.values():
+                    walk(xv)
+            elif isinstance(node, (list, tuple)):
+                for xv in node:
+                    walk(xv)
+        walk(node)
+        return deps
+
+    def common_parameter_dependencies(self):
+        # values under common-parameters feed any stack whose template
+        # declares the parameter, so their !StackOutput references are
+        # dependency edges for every such consumer
+        common = self.templates.environment_parameters.get('common-parameters', dict()) or dict()
+        deps = dict()
+        for k, xv in common.items():
+            d = self.collect_stack_outputs(xv)
+            if d:
+                deps[k] = d
+        return deps
+
+    def stack_dependencies(self, stack, common_deps=None):
+        # the whole stack definition can carry !StackOutput references:
+        # parameters, stackset rollout overrides and the like
+        deps = self.collect_stack_outputs(stack.template.template_parameters)
+        if common_deps:
+            declared = stack.template.template_body.parameters
+            specific = stack.template.template_parameters.get('parameters', dict()) or dict()
+            for k, d in common_deps.items():
+                # a stack-specific value shadows the common one, no edge then
+                if k in declared and k not in specific:
+                    deps |= d
+        deps.discard(stack.template.name)
+        return deps
+
+    def deployment_order(self):
+        stack_names = {xs.template.name for xs in self.stacks}
+        common_deps = self.common_parameter_dependencies()
+        remaining = list(self.stacks)
+        deployed = set()
+        while remaining:
+            level = [xs for xs in remaining
+                if not self.stack_dependencies(xs, common_deps) & stack_names - deployed]
+            if not level:
+                # dependency cycle, fall back to configuration order
+                level = [remaining[0]]
+            deployed.update(xs.template.name for xs in level)
+            remaining = [xs for xs in remaining if xs not in level]
+            yield level
 
     def deploy_stacks(self):
-        for xs in self.stacks:
-            util.log_section(f'Deploying {xs.template.template_type} {xs.stack_name}')
-            p = util.StackParameters(self.s3_bucket, xs.template, self.manifest, self.options, self)
-            xs.set_parameters(p)
-            if xs.template.tags:
-                xs.validate_tags(xs.template.tags)
-            xs.deploy()
-            util.log_section(f'{xs.stack_name} deployment complete')
+        for xlevel in self.deployment_order():
+            for xs in xlevel:
+                util.log_section(f'Preparing {xs.template.template_type} {xs.stack_name}')
+                p = util.StackParameters(self.s3_bucket, xs.template, self.manifest, self.options, self)
+                xs.set_parameters(p)
+                if xs.template.tags:
+                    xs.validate_tags(xs.template.tags)
+            util.log_section(f'Deploying {", ".join(xs.stack_name for xs in xlevel)}')
+            cfn_stack.CloudformationStack.deploy_many(xlevel)
+            util.log_section(f'{", ".join(xs.stack_name for xs in xlevel)} deployment complete')
 
     def teardown_stacks(self):
-        for xs in reversed(self.stacks):
-            xs.teardown()
+        for xlevel in reversed(list(self.deployment_order())):
+            cfn_stack.CloudformationStack.teardown_many(xlevel)
 
 
 class StackDeployer(object):
@@ -117,8 +179,10 @@ class StackDeployer(object):
     def setup_args(self):
         self.bucket = self.set_bucket()
         if self.o.org_arn is not None:
-            if util.ORG_ARN_RE.match(self.o.org_arn) is None:
+            m = util.ORG_ARN_RE.match(self.o.org_arn)
+            if m is None:
                 raise util.InvalidParameters(f'Organisation ARN must be a valid ARN, not [{self.o.org_arn}]')
+            self.org_id = m.group('org_id')
             self.set_bucket_policy()
         self.environment_parameters = self.read_parameters_yaml()
 
@@ -150,27 +214,28 @@ class StackDeployer(object):
         env_config_path = os.path.join(self.o.parameters_dir, f'{self.o.runtime_environment}.yaml')
         log.info(f'Loading environment parameters from {Fore.GREEN}{env_config_path}{Style.RESET_ALL}')
         try:
-            with open(env_config_path, 'r') as f:
-                return yaml.load(f, Loader=util.IgnoreYamlLoader)
+            with open(env_config_path, 'rb') as f:
+                return yaml.load(f.read(), Loader=util.IgnoreYamlLoader)
         except OSError:
             raise util.InvalidParameters(f'You have specified runtime environment {self.o.runtime_environment},'
                 f' but the file {env_config_path} does not exist') from None
 
     def set_bucket_policy(self) -> None:
-        org_id = util.ORG_ARN_RE.match(self.o.org_arn).group('org_id')
-        policy_template = Template('''
-        { "Version": "2012-10-17", "Statement": [ {
-            "Sid": "ReadTemplatesBucket",
-            "Effect": "Allow",
-            "Principal": { "AWS": "*" },
-            "Action": ["s3:GetObject","s3:ListBucket"],
-            "Resource": ["arn:aws:s3:::${bucket_name}/*","arn:aws:s3:::${bucket_name}"],
-            "Condition": {"StringEquals":
-                {"aws:PrincipalOrgID": [ "${aws_org_id}" ]}
-            }
-        } ] }
-        ''')
-        policy_text = policy_template.substitute(bucket_name=self.bucket.name, aws_org_id=org_id).strip()
+        # setup_args has already matched the ARN; build the policy straight
+        # through json.dumps instead of a string.Template substitution
+        policy_text = json.dumps({
+            'Version': '2012-10-17',
+            'Statement': [{
+                'Sid': 'ReadTemplatesBucket',
+                'Effect': 'Allow',
+                'Principal': {'AWS': '*'},
+                'Action': ['s3:GetObject', 's3:ListBucket'],
+                'Resource': [f'arn:aws:s3:::{self.bucket.name}/*', f'arn:aws:s3:::{self.bucket.name}'],
+                'Condition': {'StringEquals':
+                    {'aws:PrincipalOrgID': [self.org_id]}
+                }
+            }]
+        })
         log.info(f'Allowing access to the bucket for AWS Organization {Fore.GREEN}{self.o.org_arn}{Style.RESET_ALL}...')
         log.debug("Policy text will follow...")
         log.debug(policy_text)
@@ -179,7 +244,7 @@ class StackDeployer(object):
 
     def set_bucket(self):
         r = util.session.resource('s3')
-        c = util.session.client('s3')
+        c = util.cached_client('s3')
         b = r.Bucket(f'{self.o.installation_name}-{self.o.component_name}.{self.o.dns_domain}')
         v = r.BucketVersioning(b.name)
         log.info(f'Creating S3 bucket {Fore.GREEN}{b.name}{Style.RESET_ALL}...')
@@ -209,12 +274,22 @@ class StackDeployer(object):
         return b
 
     def delete_bucket(self):
-        while len(list(self.bucket.object_versions.limit(1))) > 0:
-            log.info(f'Deleting object versions in bucket {Fore.GREEN}{self.bucket.name}{Style.RESET_ALL}...')
-            self.bucket.object_versions.limit(1000).delete()
-        while len(list(self.bucket.objects.limit(1))) > 0:
-            log.info(f'Deleting objects in bucket {Fore.GREEN}{self.bucket.name}{Style.RESET_ALL}...')
-            self.bucket.objects.limit(1000).delete()
+        # stream the version listing and batch the deletes instead of probing
+        # emptiness with a one-object listing on every loop iteration
+        c = util.cached_client('s3')
+        log.info(f'Deleting object versions in bucket {Fore.GREEN}{self.bucket.name}{Style.RESET_ALL}...')
+        for page in c.get_paginator('list_object_versions').paginate(
+                Bucket=self.bucket.name, PaginationConfig={'PageSize': 1000}):
+            batch = [{'Key': xv['Key'], 'VersionId': xv['VersionId']}
+                for xs in ('Versions', 'DeleteMarkers') for xv in page.get(xs, list())]
+            if batch:
+                c.delete_objects(Bucket=self.bucket.name, Delete={'Objects': batch, 'Quiet': True})
+        log.info(f'Deleting objects in bucket {Fore.GREEN}{self.bucket.name}{Style.RESET_ALL}...')
+        for page in c.get_paginator('list_objects_v2').paginate(
+                Bucket=self.bucket.name, PaginationConfig={'PageSize': 1000}):
+            batch = [{'Key': xo['Key']} for xo in page.get('Contents', list())]
+            if batch:
+                c.delete_objects(Bucket=self.bucket.name, Delete={'Objects': batch, 'Quiet': True})
         log.info(f'Deleting S3 bucket {Fore.GREEN}{self.bucket.name}{Style.RESET_ALL}...')
         self.bucket.delete()
         log.info(f'Successfully deleted S3 bucket {Fore.GREEN}{self.bucket.name}{Style.RESET_ALL}...')
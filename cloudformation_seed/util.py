@@ -1,9 +1,14 @@
 from dataclasses import dataclass
 from typing import List, Tuple, Dict, Any, Optional, Union
 from pathlib import Path
+import fnmatch
 import types
 import logging
+import threading
+from concurrent import futures
+import functools
 import boto3
+import botocore.config
 import re
 import os
 import yaml
@@ -19,33 +24,107 @@ class ColorFormatter(logging.Formatter):
     YELLOW_LEVELS_ABOVE = logging.WARNING
     RED_LEVELS_ABOVE = logging.ERROR
 
-    def format(self, record, *args, **kwargs):
-        new_record = copy.copy(record)
-        new_record.levelname = f'{Style.DIM}{new_record.levelname}{Style.RESET_ALL}'
+    MSG_PREFIXES: Dict[int, str] = dict()
+    DIM_LEVELNAMES: Dict[str, str] = dict()
 
-        if new_record.levelno <= self.__class__.DIM_LEVELS_BELOW:
-            new_record.msg = f'{Style.DIM}{new_record.msg}'
-        elif self.__class__.YELLOW_LEVELS_ABOVE <= new_record.levelno < self.__class__.RED_LEVELS_ABOVE:
-            new_record.msg = f'{Fore.YELLOW}{new_record.msg}'
-        elif self.__class__.RED_LEVELS_ABOVE <= new_record.levelno:
-            new_record.msg = f'{Fore.RED}{new_record.msg}'
+    @classmethod
+    def msg_prefix(cls, levelno: int) -> str:
+        # the colour bucket only depends on the level, resolve it once per level
+        try:
+            return cls.MSG_PREFIXES[levelno]
+        except KeyError:
+            if levelno <= cls.DIM_LEVELS_BELOW:
+                prefix = Style.DIM
+            elif cls.YELLOW_LEVELS_ABOVE <= levelno < cls.RED_LEVELS_ABOVE:
+                prefix = Fore.YELLOW
+            elif cls.RED_LEVELS_ABOVE <= levelno:
+                prefix = Fore.RED
+            else:
+                prefix = ''
+            cls.MSG_PREFIXES[levelno] = prefix
+            return prefix
 
-        new_record.msg = f'{new_record.msg}{Style.RESET_ALL}'
-        return super().format(new_record, *args, **kwargs)
+    @classmethod
+    def dim_levelname(cls, levelname: str) -> str:
+        try:
+            return cls.DIM_LEVELNAMES[levelname]
+        except KeyError:
+            dimmed = cls.DIM_LEVELNAMES[levelname] = f'{Style.DIM}{levelname}{Style.RESET_ALL}'
+            return dimmed
+
+    def format(self, record, *args, **kwargs):
+        # colour the record in place and restore it afterwards, so other
+        # handlers see it untouched without copying every record
+        levelname, msg = record.levelname, record.msg
+        record.levelname = self.dim_levelname(levelname)
+        record.msg = f'{self.msg_prefix(record.levelno)}{msg}{Style.RESET_ALL}'
+        try:
+            return super().format(record, *args, **kwargs)
+        finally:
+            record.levelname, record.msg = levelname, msg
 
 
 def log_section(section_text, color=Fore.CYAN, bold=False):
     log.info(f' {color}{section_text}{Style.RESET_ALL} '.center(80, '=' if bold else '-'))
 
 
-class IgnoreYamlLoader(yaml.Loader):
+@functools.lru_cache(maxsize=256)
+def glob_files(root: str, pattern: str) -> Tuple[Path, ...]:
+    # repeated !IncludeAll directives reuse the same globs; the directory
+    # walk and its stat calls only need to happen once per pattern
+    return tuple(Path(root).glob(pattern))
+
+
+def coerce_parameter_value(v) -> str:
+    # CFN parameter values are strings; lists collapse into a comma-delimited one
+    return ','.join(v) if isinstance(v, list) else str(v)
+
+
+# the libyaml-backed loader parses several times faster than the pure-Python
+# one; fall back when PyYAML was built without the C extension
+YamlLoaderBase = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class IgnoreYamlLoader(YamlLoaderBase):
     pass
 
 
+# CFN intrinsics (!Ref, !GetAtt, ...) resolve through the multi-constructor
+# without falling back to the catch-all; both keep the raw node so the
+# template walkers can still see the tags without constructing the subtree
+IgnoreYamlLoader.add_multi_constructor('!', lambda l, t, n: n)
 IgnoreYamlLoader.add_constructor(None, lambda l, n: n)
 
 session = boto3.Session()
 
+# adaptive retries back off under Cloudformation's low throttling ceiling
+# instead of storming it, and the larger keep-alive pool serves parallel
+# deploys without re-establishing TLS for every poll
+CLIENT_CONFIG = botocore.config.Config(
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    max_pool_connections=50,
+    tcp_keepalive=True
+)
+
+_thread_sessions = threading.local()
+
+
+@functools.lru_cache(maxsize=None)
+def cached_client(name: str):
+    # client construction loads the service model and resolves the endpoint
+    # every time; one client per service is enough, and unlike sessions
+    # botocore clients are safe to share between threads
+    return session.client(name, config=CLIENT_CONFIG)
+
+
+def thread_session() -> boto3.Session:
+    # boto3 sessions are not thread-safe, hand every worker thread its own
+    if threading.current_thread() is threading.main_thread():
+        return session
+    if not hasattr(_thread_sessions, 'session'):
+        _thread_sessions.session = boto3.Session()
+    return _thread_sessions.session
+
 
 class InvalidParameters(Exception): pass            # noqa E701,E302
 class InvalidStackConfiguration(Exception): pass    # noqa E701,E302
@@ -54,22 +133,53 @@ class StackTemplateInvalid(Exception): pass         # noqa E701,E302
 
 
 ORG_ARN_RE = re.compile(r'^arn:aws:organizations::\d{12}:\w+/(?P<org_id>o-\w+)')
+STACK_OUTPUT_RE = re.compile(r'^(?P<stack_name>[^\.]+)\.(?P<output_name>[^\.:]+)(:(?P<default_value>.*))?$')
+SSM_DIRECT_RE = re.compile(rb'!SSMParameterDirect\s+["\']?([^\s"\'#]+)')
+
+_all_stacks: Optional[Dict[str, Any]] = None
+
+
+def describe_all_stacks(refresh: bool = False) -> Dict[str, Any]:
+    # one paginated DescribeStacks covers every stack lookup in the run,
+    # instead of one API round-trip per CloudformationStack instance
+    global _all_stacks
+    if _all_stacks is None or refresh:
+        c = cached_client('cloudformation')
+        _all_stacks = {xs['StackName']: xs
+            for page in c.get_paginator('describe_stacks').paginate()
+            for xs in page['Stacks']}
+    return _all_stacks
 
 
 class DirectoryScanner(object):
+    def walk_files(self, path: str):
+        # recursive scandir keeps the file type on the DirEntry itself, so
+        # the walk never stats a path twice; symlinked directories are left
+        # alone to keep the walk loop-free
+        with os.scandir(path) as entries:
+            for xe in entries:
+                if xe.is_dir(follow_symlinks=False):
+                    yield from self.walk_files(xe.path)
+                elif xe.is_file():
+                    yield xe
+
     def scan_directories(self, path: str, glob: str = '**/*') -> List[Tuple[str, str]]:
-        u = list()
-        for item in Path(path).glob(glob):
-            if Path.is_file(item):
-                relative_path = str(item)
-                key = relative_path[len(path):].strip(os.sep)
-                u.extend([(key, relative_path)])
-        return u
+        if glob.startswith('**/'):
+            pattern = glob[3:]
+            return [(os.path.relpath(xe.path, path), xe.path)
+                for xe in self.walk_files(path) if fnmatch.fnmatch(xe.name, pattern)]
+        return [(os.path.relpath(str(item), path), str(item))
+            for item in Path(path).glob(glob) if item.is_file()]
 
 
 class VersionManifest(object):
     def __init__(self, s3_bucket: Any, s3_key: str) -> None:
-        self.manifest: Dict[str, Any] = self.load_manifest(s3_bucket, s3_key)
+        m = self.load_manifest(s3_bucket, s3_key)
+        # only the release version and the artifact index are consulted after
+        # the load, so the rest of a large manifest is released right away
+        self.release_version: Any = m['release']['release_version']
+        self.artifacts_by_name: Dict[str, Dict[str, Any]] = \
+            {xa['name']: xa for xa in m['release'].get('artifacts', list())}
 
     def load_manifest(self, s3_bucket: Any, s3_key: str) -> Dict[str, Any]:
         if s3_key is None:
@@ -78,7 +188,9 @@ class VersionManifest(object):
         log.info(f'Loading version manifest from {Fore.GREEN}s3://{s3_bucket.name}/{s3_key}{Style.RESET_ALL}')
         o = s3_bucket.Object(s3_key)
         r: Dict[str, Any] = o.get()
-        m: Dict[str, Any] = yaml.load(r['Body'], Loader=yaml.SafeLoader)
+        # hand the C loader one bytes object instead of a StreamingBody it
+        # would refill chunk by chunk through Python-level callbacks
+        m: Dict[str, Any] = yaml.load(r['Body'].read(), Loader=YamlLoaderBase)
         log.info(f'Loaded version manifest for release {Fore.YELLOW}{m["release"]["release_version"]}{Style.RESET_ALL} '
             f'(S3 version: {Fore.YELLOW}{o.version_id}{Style.RESET_ALL})')
         log.debug('Version Manifest'.center(64, '-'))
@@ -94,10 +206,10 @@ class VersionManifest(object):
         }
 
     def get_artifact_by_name(self, name: str) -> Dict[str, Any]:
-        for xa in self.manifest['release'].get('artifacts', list()):
-            if xa['name'] == name:
-                return xa
-        raise DeploymentFailed(f'Artifact {name} is not part of the release')
+        try:
+            return self.artifacts_by_name[name]
+        except KeyError:
+            raise DeploymentFailed(f'Artifact {name} is not part of the release') from None
 
 
 class SSMParameters(object):
@@ -109,18 +221,26 @@ class SSMParameters(object):
     def parameter_path(self, parameter_name: str) -> str:
         return f'/{self.product_name}/{self.installation_name}/{parameter_name}'
 
+    def set_parameter(self, c, k: str, v: str) -> None:
+        log.info(f'Setting SSM {Fore.GREEN}{self.parameter_path(k)}{Style.RESET_ALL}='
+            f'[{Fore.GREEN}{v}{Style.RESET_ALL}]')
+        c.put_parameter(
+            Name=self.parameter_path(k),
+            Description='Set by Cloudformation Seed',
+            Value=v,
+            Type='String',
+            Overwrite=True
+        )
+
     def set_all_parameters(self) -> None:
-        c = session.client('ssm')
-        for k, v in self.parameters.items():
-            log.info(f'Setting SSM {Fore.GREEN}{self.parameter_path(k)}{Style.RESET_ALL}='
-                f'[{Fore.GREEN}{v}{Style.RESET_ALL}]')
-            c.put_parameter(
-                Name=self.parameter_path(k),
-                Description='Set by Cloudformation Seed',
-                Value=v,
-                Type='String',
-                Overwrite=True
-            )
+        # each put_parameter is an independent round-trip, overlap them
+        if not self.parameters:
+            return
+        c = cached_client('ssm')
+        with futures.ThreadPoolExecutor(max_workers=min(len(self.parameters), 10)) as pool:
+            running = [pool.submit(self.set_parameter, c, k, v) for k, v in self.parameters.items()]
+            for xf in futures.as_completed(running):
+                xf.result()
 
 
 class StackParameters(object):
@@ -141,8 +261,20 @@ class StackParameters(object):
         self.param_overrides = options.param_overrides or list()
 
         self.parameters_loader = self.configure_parameters_loader()
-        self.STACK_OUTPUT_RE = \
-            re.compile(r'^(?P<stack_name>[^\.]+)\.(?P<output_name>[^\.:]+)(:(?P<default_value>.*))?$')
+        self.include_cache: Dict[Tuple[str, float], Any] = dict()
+        self.ssm_parameter_cache: Dict[str, str] = dict()
+        self.objpath_tree_cache: Dict[int, Tuple[Any, objectpath.Tree]] = dict()
+        # dict dispatch beats a string-compare ladder on every unresolved
+        # parameter; lambdas defer the attribute reads until lookup time
+        self.special_parameters = {
+            'ProductName': lambda: self.product_name,
+            'InstallationName': lambda: self.installation_name,
+            'TemplatesS3Bucket': lambda: self.bucket.name,
+            'Route53ZoneDomain': lambda: self.dns_domain,
+            'RuntimeEnvironment': lambda: self.runtime_environment,
+            'AWSOrganizationID': lambda: self.aws_org_id,
+            'AWSOrganizationARN': lambda: self.aws_org_arn
+        }
 
         self.environment_parameters = \
             self.read_parameters_yaml(
@@ -151,11 +283,20 @@ class StackParameters(object):
             )
 
         self.common_parameters = self.environment_parameters.get('common-parameters', dict())
-        self.stack_definition = [xs for xs in self.environment_parameters['stacks']
-                                    if xs['name'] == self.template.name].pop()
+        self.stacks_by_name = {xs['name']: xs for xs in self.environment_parameters['stacks']}
+        try:
+            self.stack_definition = self.stacks_by_name[self.template.name]
+        except KeyError:
+            raise InvalidStackConfiguration(
+                f'Stack {self.template.name} is not defined in the environment') from None
         self.specific_parameters = self.stack_definition.get('parameters', dict())
 
+        stack_name = self.stack_definition['name']
+        self.overrides_for_stack = {xp[1]: xp[2] for xp in self.param_overrides if xp[0] == stack_name}
+        self.overrides_global = {xp[1]: xp[2] for xp in self.param_overrides if xp[0] is None}
+
         self.parameters = self.parse_parameters()
+        self.formatted_parameters: Optional[List[Dict[str, str]]] = None
 
         self.stackset_admin_role_arn: Optional[str] = self.stack_definition.get('admin_role_arn')
         self.stackset_exec_role_name: Optional[str] = self.stack_definition.get('exec_role_name')
@@ -173,13 +314,18 @@ class StackParameters(object):
         self.rollout = self.format_rollout()
 
     def format_rollout(self):
-        c = session.client('cloudformation')
         if 'rollout' not in self.stack_definition:
             return None
+        # resolve the session region once, not per rollout entry, and only
+        # build the default set when an entry actually needs it
+        default_region = cached_client('cloudformation').meta.region_name
         rollout = self.stack_definition['rollout']
         for xr in rollout:
-            xr['regions'] = set(xr.get('regions', {c.meta.region_name}))
-            xr['override'] = [{'ParameterKey': k, 'ParameterValue': str(v) if not isinstance(v, list) else ','.join(v)}
+            regions = xr.get('regions')
+            # an explicit empty list means no instances for this target;
+            # only a missing key falls back to the session region
+            xr['regions'] = set(regions) if regions is not None else {default_region}
+            xr['override'] = [{'ParameterKey': k, 'ParameterValue': coerce_parameter_value(v)}
                 for k, v in xr.get('override', dict()).items() if v is not None]
         return rollout
 
@@ -197,7 +343,7 @@ class StackParameters(object):
         return rollout_autodeploy
 
     def configure_parameters_loader(self):
-        class ParametersLoader(yaml.Loader):
+        class ParametersLoader(YamlLoaderBase):
             pass
         ParametersLoader.add_constructor('!ObjectPath', self.run_objectpath)
         ParametersLoader.add_constructor('!IncludeAll', self.include_files)
@@ -215,7 +361,14 @@ class StackParameters(object):
         return ParametersLoader
 
     def run_objpath_core(self, data, objpath):
-        r = objectpath.Tree(data).execute(objpath)
+        # Tree() walks the whole data structure up front; the same subtree is
+        # queried once per matched include file, so cache trees by identity
+        # for the duration of the parse. Keeping data in the entry pins it
+        # alive so its id cannot be recycled while the cache holds it
+        cached = self.objpath_tree_cache.get(id(data))
+        if cached is None:
+            cached = self.objpath_tree_cache[id(data)] = (data, objectpath.Tree(data))
+        r = cached[1].execute(objpath)
         if isinstance(r, types.GeneratorType):
             return list(r)
         return r
@@ -231,7 +384,7 @@ class StackParameters(object):
 
     def include_files_cat(self, files_glob, objpath):
         node = list()
-        for f in Path(self.parameters_dir).glob(files_glob):
+        for f in glob_files(self.parameters_dir, files_glob):
             log.info(f'Concatenating from {f}...')
             r = self.read_parameters_yaml(f)
             if objpath is not None:
@@ -241,7 +394,7 @@ class StackParameters(object):
 
     def include_files_merge(self, files_glob, objpath):
         node = dict()
-        for f in Path(self.parameters_dir).glob(files_glob):
+        for f in glob_files(self.parameters_dir, files_glob):
             log.info(f'Merging from {f}...')
             r = self.read_parameters_yaml(f)
             if objpath is not None:
@@ -263,12 +416,12 @@ class StackParameters(object):
         else:
             log.info(f'Merging include file(s) from {cmd.files_glob}...')
             val = self.include_files_merge(cmd.files_glob, cmd.objpath)
-        log.debug(f'Successfully read include file(s) from {cmd.files_glob}')
+        log.debug('Successfully read include file(s) from %s', cmd.files_glob)
         return val
 
     def set_builtin(self, loader, node):
         param_name = loader.construct_scalar(node)
-        log.debug(f'Setting parameter {param_name}...')
+        log.debug('Setting parameter %s...', param_name)
         val = self.get_special_parameter_value(param_name)
         if val is None:
             raise InvalidStackConfiguration(f'Unsupported builtin parameter [{param_name}]')
@@ -276,7 +429,7 @@ class StackParameters(object):
 
     def set_env_var(self, loader, node):
         var_name = loader.construct_scalar(node)
-        log.debug(f'Looking up environment variable {var_name}...')
+        log.debug('Looking up environment variable %s...', var_name)
         try:
             val = os.environ[var_name]
             return val
@@ -285,132 +438,167 @@ class StackParameters(object):
 
     def set_lambda_zip(self, loader, node):
         zip_name = loader.construct_scalar(node)
-        log.debug(f'Looking up Lambda zip {zip_name}...')
+        log.debug('Looking up Lambda zip %s...', zip_name)
         val = self.environment.lambdas.find_lambda_key(zip_name)
-        log.debug(f'Found Lambda zip {val}...')
+        log.debug('Found Lambda zip %s...', val)
         return val
 
     def set_cloudformation_template_s3_key(self, loader, node):
         template_name = loader.construct_scalar(node)
-        log.debug(f'Looking up Cloudformation template {template_name}...')
+        log.debug('Looking up Cloudformation template %s...', template_name)
         t = self.environment.templates.find_template(template_name)
         val = t.template_s3_key
-        log.debug(f'Found template {val}...')
+        log.debug('Found template %s...', val)
         return val
 
     def set_cloudformation_template_url(self, loader, node):
         template_name = loader.construct_scalar(node)
-        log.debug(f'Looking up Cloudformation template {template_name}...')
+        log.debug('Looking up Cloudformation template %s...', template_name)
         t = self.environment.templates.find_template(template_name)
         val = t.template_url
-        log.debug(f'Found template {val}...')
+        log.debug('Found template %s...', val)
         return val
 
     def set_stack_output(self, loader, node):
         output_id = loader.construct_scalar(node)
-        m = self.STACK_OUTPUT_RE.match(output_id)
+        m = STACK_OUTPUT_RE.match(output_id)
         if m is None:
             raise InvalidStackConfiguration(f'Output specification [{output_id}] invalid, '
                 f'must be stack-name.OutputId:default value')
-        log.debug(f'Looking up stack output {output_id}...')
+        log.debug('Looking up stack output %s...', output_id)
         val = self.environment.find_stack_output(m.group('stack_name'), m.group('output_name'))
         if val is None:
             if m.group('default_value') is not None:
                 val = m.group('default_value')
-        log.debug(f'Found stack output {val}...')
+        log.debug('Found stack output %s...', val)
         return val
 
+    def prefetch_ssm_parameters(self, data: bytes) -> None:
+        # the yaml constructors run serially during parse, so every
+        # !SSMParameterDirect tag would otherwise cost its own blocking
+        # round-trip; get_parameters takes ten names per call
+        paths = [f'/{self.product_name}/{self.installation_name}/{xn.decode()}'
+            for xn in set(SSM_DIRECT_RE.findall(data))]
+        paths = [xp for xp in paths if xp not in self.ssm_parameter_cache]
+        if not paths:
+            return
+        c = cached_client('ssm')
+        batches = [paths[i:i + 10] for i in range(0, len(paths), 10)]
+
+        def fetch(batch):
+            return c.get_parameters(Names=batch, WithDecryption=True)['Parameters']
+        with futures.ThreadPoolExecutor(max_workers=min(len(batches), 10)) as pool:
+            for params in pool.map(fetch, batches):
+                for xp in params:
+                    self.ssm_parameter_cache[xp['Name']] = xp['Value']
+
     def set_ssm_parameter(self, loader, node):
-        c = session.client('ssm')
         parameter_name = loader.construct_scalar(node)
         parameter_path = f'/{self.product_name}/{self.installation_name}/{parameter_name}'
-        log.debug(f'Looking up SSM parameter {parameter_path}...')
+        log.debug('Looking up SSM parameter %s...', parameter_path)
+        if parameter_path in self.ssm_parameter_cache:
+            return self.ssm_parameter_cache[parameter_path]
+        # anything the prefetch did not return, typically a missing
+        # parameter, surfaces its error through the direct call
+        c = cached_client('ssm')
         r = c.get_parameter(Name=parameter_path, WithDecryption=True)
-        val = r['Parameter']['Value']
-        log.debug(f'Found parameter version {r["Parameter"]["Version"]}: {val}...')
+        val = self.ssm_parameter_cache[parameter_path] = r['Parameter']['Value']
+        log.debug('Found parameter version %s: %s...', r['Parameter']['Version'], val)
         return val
 
     def set_ssm_parameter_declared(self, loader, node):
         parameter_name = loader.construct_scalar(node)
         parameter_path = f'/{self.product_name}/{self.installation_name}/{parameter_name}'
-        log.debug(f'Setting declared SSM parameter to {parameter_path}')
+        log.debug('Setting declared SSM parameter to %s', parameter_path)
         return parameter_path
 
     def set_artifact_version(self, loader, node):
         artifact_name = loader.construct_scalar(node)
-        log.debug(f'Looking up artifact {artifact_name}...')
+        log.debug('Looking up artifact %s...', artifact_name)
         artifact = self.manifest.get_artifact_by_name(artifact_name)
         val = artifact['version']
-        log.debug(f'Found version {val} for artifact {artifact_name}...')
+        log.debug('Found version %s for artifact %s...', val, artifact_name)
         return val
 
     def set_artifact_repo(self, loader, node):
         artifact_name = loader.construct_scalar(node)
-        log.debug(f'Looking up artifact {artifact_name}...')
+        log.debug('Looking up artifact %s...', artifact_name)
         artifact = self.manifest.get_artifact_by_name(artifact_name)
         val = artifact['artifactory_host']
-        log.debug(f'Found repo {val} for artifact {artifact_name}...')
+        log.debug('Found repo %s for artifact %s...', val, artifact_name)
         return val
 
     def set_artifact_image(self, loader, node):
         artifact_name = loader.construct_scalar(node)
-        log.debug(f'Looking up artifact {artifact_name}...')
+        log.debug('Looking up artifact %s...', artifact_name)
         artifact = self.manifest.get_artifact_by_name(artifact_name)
         val = f'{artifact["artifactory_host"]}/{artifact_name}:{artifact["version"]}'
-        log.debug(f'Found image name {val} for artifact {artifact_name}...')
+        log.debug('Found image name %s for artifact %s...', val, artifact_name)
         return val
 
     def read_parameters_yaml(self, filename):
-        with open(filename, 'r') as f:
-            r = yaml.load(f, Loader=self.parameters_loader)
-            return r
+        # overlapping include globs pull the same fragment in repeatedly;
+        # parse it once and hand copies out, since callers merge with .update
+        cache_key = (os.path.abspath(filename), os.path.getmtime(filename))
+        if cache_key in self.include_cache:
+            return copy.deepcopy(self.include_cache[cache_key])
+        # feed libyaml raw bytes and let it decode UTF-8 in C instead of
+        # paying Python's text-mode decoder on the way in
+        with open(filename, 'rb') as f:
+            data = f.read()
+        self.prefetch_ssm_parameters(data)
+        r = yaml.load(data, Loader=self.parameters_loader)
+        self.include_cache[cache_key] = copy.deepcopy(r)
+        self.objpath_tree_cache.clear()
+        return r
 
     def compute_parameter_value(self, param_name):
-        common_val = self.common_parameters.get(param_name)
-        specific_val = self.specific_parameters.get(param_name)
-        for source, xv in (('OVERRIDE', self.get_parameter_override(param_name)),
-                ('SPECIFIC', specific_val),
-                ('COMMON', common_val),
-                ('BUILTIN', self.get_special_parameter_value(param_name)),
-                ('ABSENT', None)):
-            if xv is not None or source == 'ABSENT':
-                if isinstance(xv, list):
-                    xv = ','.join(xv)
-                return source, xv
+        # sources are checked in precedence order and evaluated lazily, so a
+        # winning override never pays for the builtin chain below it
+        v = self.get_parameter_override(param_name)
+        if v is not None:
+            return 'OVERRIDE', coerce_parameter_value(v)
+        v = self.specific_parameters.get(param_name)
+        if v is not None:
+            return 'SPECIFIC', coerce_parameter_value(v)
+        v = self.common_parameters.get(param_name)
+        if v is not None:
+            return 'COMMON', coerce_parameter_value(v)
+        v = self.get_special_parameter_value(param_name)
+        if v is not None:
+            return 'BUILTIN', coerce_parameter_value(v)
+        return 'ABSENT', None
 
     def get_special_parameter_value(self, param_name):
-        if param_name == 'ProductName':
-            return self.product_name
-        if param_name == 'InstallationName':
-            return self.installation_name
-        if param_name == 'TemplatesS3Bucket':
-            return self.bucket.name
-        if param_name == 'Route53ZoneDomain':
-            return self.dns_domain
-        if param_name == 'RuntimeEnvironment':
-            return self.runtime_environment
-        if param_name == 'AWSOrganizationID':
-            return self.aws_org_id
-        if param_name == 'AWSOrganizationARN':
-            return self.aws_org_arn
+        f = self.special_parameters.get(param_name)
+        return f() if f is not None else None
 
     def get_parameter_override(self, param_name):
-        for xp in self.param_overrides:
-            if xp[0] == self.stack_definition['name'] or xp[0] is None:
-                if xp[1] == param_name:
-                    return xp[2]
+        stack_override = self.overrides_for_stack.get(param_name)
+        if stack_override is not None:
+            return stack_override
+        return self.overrides_global.get(param_name)
 
     def parse_parameters(self):
         p = dict()
+        # the decorated per-parameter line is pure presentation, skip
+        # building it entirely on quiet runs
+        verbose = log.isEnabledFor(logging.INFO)
         for k in self.template.template_body.parameters.keys():
             source, v = self.compute_parameter_value(k)
-            log.info('{key:>30} ... ({source:^10}) [{value}]'.format(key=k, source=source,
-                value=f'{Fore.CYAN}>> EMPTY <<{Style.RESET_ALL}' if v is None else f'{Fore.GREEN}{v}{Style.RESET_ALL}'))
+            if verbose:
+                log.info('{key:>30} ... ({source:^10}) [{value}]'.format(key=k, source=source,
+                    value=f'{Fore.CYAN}>> EMPTY <<{Style.RESET_ALL}' if v is None
+                        else f'{Fore.GREEN}{v}{Style.RESET_ALL}'))
             p[k] = v
         return p
 
     def format_parameters(self):
-        return [{'ParameterKey': k, 'ParameterValue': str(v)} for k, v in self.parameters.items() if v is not None]
+        # parameters never change once parsed, format them at most once
+        if self.formatted_parameters is None:
+            self.formatted_parameters = [{'ParameterKey': k, 'ParameterValue': coerce_parameter_value(v)}
+                for k, v in self.parameters.items() if v is not None]
+        return self.formatted_parameters
 
     def format_role_pair(self) -> Dict[str, str]:
         if self.template.template_type != 'stackset':
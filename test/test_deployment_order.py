@@ -0,0 +1,89 @@
+import os
+import unittest
+from unittest import mock
+
+import yaml
+from cloudformation_seed import stack_deployer, util
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(stack_deployer.__file__), 'examples', 'simple')
+
+
+def load_example(filename):
+    with open(os.path.join(EXAMPLE_DIR, filename), 'rb') as f:
+        return yaml.load(f.read(), Loader=util.IgnoreYamlLoader)
+
+
+def make_stack(stack_def, declared_parameters):
+    template = mock.Mock()
+    template.name = stack_def['name']
+    template.template_parameters = stack_def
+    template.template_body.parameters = {xp: dict() for xp in declared_parameters}
+    stack = mock.Mock()
+    stack.template = template
+    return stack
+
+
+def make_parser(environment_parameters, stacks):
+    parser = object.__new__(stack_deployer.StackParser)
+    parser.templates = mock.Mock()
+    parser.templates.environment_parameters = environment_parameters
+    parser.stacks = stacks
+    return parser
+
+
+class TestDeploymentOrder(unittest.TestCase):
+    def setUp(self):
+        self.env = load_example(os.path.join('parameters', 'dev.yaml'))
+        self.stacks = dict()
+        for xs in self.env['stacks']:
+            body = load_example(os.path.join('cloudformation', xs['template']))
+            self.stacks[xs['name']] = make_stack(xs, (body.get('Parameters') or dict()).keys())
+
+    def level_index(self, parser):
+        return {xs.template.name: i
+            for i, xlevel in enumerate(parser.deployment_order()) for xs in xlevel}
+
+    def test_example_orders_every_stack_once(self):
+        parser = make_parser(self.env, list(self.stacks.values()))
+        levels = self.level_index(parser)
+        self.assertEqual(set(levels), set(self.stacks), 'every stack must be scheduled exactly once')
+
+    def test_common_parameter_consumer_deploys_after_producer(self):
+        # give the watchdog template the parameter fed from common-parameters;
+        # the !StackOutput there must order it after the kms lambda stack
+        consumer = self.stacks['centralservices-s3-watchdog-lambda']
+        consumer.template.template_body.parameters['KmsDecryptLambdaArn'] = dict()
+        parser = make_parser(self.env, list(self.stacks.values()))
+        levels = self.level_index(parser)
+        self.assertGreater(levels['centralservices-s3-watchdog-lambda'],
+            levels['my-project-kms-decrypt-lambda'],
+            'common-parameters !StackOutput consumer must deploy after its producer')
+
+    def test_stack_specific_value_shadows_common_parameter(self):
+        consumer = self.stacks['my-project']
+        consumer.template.template_body.parameters['KmsDecryptLambdaArn'] = dict()
+        consumer.template.template_parameters = \
+            {**consumer.template.template_parameters,
+                'parameters': {**consumer.template.template_parameters['parameters'],
+                    'KmsDecryptLambdaArn': 'arn:aws:lambda:us-east-1:000000000000:function:static'}}
+        parser = make_parser(self.env, list(self.stacks.values()))
+        common_deps = parser.common_parameter_dependencies()
+        self.assertEqual(parser.stack_dependencies(consumer, common_deps), set(),
+            'a stack-specific value must shadow the common-parameters edge')
+
+    def test_rollout_override_creates_edge(self):
+        stackset = self.stacks['example-stackset-template']
+        stackset.template.template_parameters = \
+            {**stackset.template.template_parameters,
+                'rollout': [{'account': '000000000000',
+                    'override': {'WatchdogArn': yaml.ScalarNode('!StackOutput',
+                        'centralservices-s3-watchdog-lambda.WatchdogLambdaArn')}}]}
+        parser = make_parser(self.env, list(self.stacks.values()))
+        levels = self.level_index(parser)
+        self.assertGreater(levels['example-stackset-template'],
+            levels['centralservices-s3-watchdog-lambda'],
+            'a !StackOutput in a rollout override must order the stackset after the producer')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import time
+import unittest
+from unittest import mock
+from cloudformation_seed.cfn_stack import PollingCoordinator
+
+
+@mock.patch('cloudformation_seed.cfn_stack.util.thread_session')
+class TestPollingCoordinator(unittest.TestCase):
+    def setUp(self):
+        self.poller = PollingCoordinator(delay=0.01)
+
+    def wait_thread_exit(self):
+        for _ in range(100):
+            if self.poller.thread is None:
+                return
+            time.sleep(0.01)
+        self.fail('poll thread should have exited')
+
+    def test_resolves_finished_stack(self, mock_session):
+        with mock.patch.object(PollingCoordinator, 'describe_stack_statuses',
+                return_value={'s1': 'CREATE_COMPLETE'}):
+            waiter = self.poller.register('s1')
+            self.assertTrue(waiter['event'].wait(2), 'waiter should be resolved')
+        self.assertEqual(waiter['status'], 'CREATE_COMPLETE')
+        self.assertIsNone(waiter['error'])
+        self.wait_thread_exit()
+
+    def test_missing_stack_means_deleted(self, mock_session):
+        with mock.patch.object(PollingCoordinator, 'describe_stack_statuses', return_value=dict()):
+            waiter = self.poller.register('s1')
+            self.assertTrue(waiter['event'].wait(2), 'waiter should be resolved')
+        self.assertEqual(waiter['status'], 'DELETE_COMPLETE')
+
+    def test_describe_failure_reaches_waiters(self, mock_session):
+        with mock.patch.object(PollingCoordinator, 'describe_stack_statuses',
+                side_effect=RuntimeError('token expired')):
+            waiter = self.poller.register('s1')
+            self.assertTrue(waiter['event'].wait(2), 'waiter should be resolved')
+        self.assertIsInstance(waiter['error'], RuntimeError)
+        self.assertIsNone(waiter['status'])
+        self.wait_thread_exit()
+        self.assertEqual(self.poller.waiters, dict())
+
+    def test_late_registration_skips_stale_snapshot(self, mock_session):
+        # s2 registers while the first describe is in flight; its create has
+        # not reached that snapshot, so it must only resolve from the next one
+        late = dict()
+
+        def describe(c):
+            if not late:
+                late['waiter'] = self.poller.register('s2')
+                return {'s1': 'CREATE_COMPLETE'}
+            return {'s2': 'CREATE_COMPLETE'}
+        with mock.patch.object(PollingCoordinator, 'describe_stack_statuses', side_effect=describe):
+            waiter = self.poller.register('s1')
+            self.assertTrue(waiter['event'].wait(2), 'first waiter should be resolved')
+            self.assertTrue(late['waiter']['event'].wait(2), 'late waiter should be resolved')
+        self.assertEqual(waiter['status'], 'CREATE_COMPLETE')
+        self.assertEqual(late['waiter']['status'], 'CREATE_COMPLETE',
+            'late waiter must not be resolved as deleted from the stale snapshot')
+
+    def test_deregister_lets_the_thread_exit(self, mock_session):
+        with mock.patch.object(PollingCoordinator, 'describe_stack_statuses',
+                return_value={'s1': 'CREATE_IN_PROGRESS'}):
+            waiter = self.poller.register('s1')
+            self.assertFalse(waiter['event'].wait(0.05), 'waiter should still be pending')
+            self.poller.deregister('s1', waiter)
+            self.assertEqual(self.poller.waiters, dict())
+            self.wait_thread_exit()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -109,7 +109,7 @@ class TestGroupedRollout(unittest.TestCase):
 
     @mock.patch('cloudformation_seed.util.session')
     def test_single_region_no_update(self, mock_session):
-        mock_session.client.return_value.list_stack_instances.return_value = existing_stack_simple
+        mock_session.client.return_value.get_paginator.return_value.paginate.return_value = [existing_stack_simple]
         mock_session.client.return_value.describe_stack_instance.return_value = existing_stack_instance
         config = [{
             'account': xa['Account'],
@@ -134,7 +134,7 @@ class TestGroupedRollout(unittest.TestCase):
                 'regions': regions,
                 'override': existing_stack_instance['StackInstance']['ParameterOverrides']
             })
-        mock_session.client.return_value.list_stack_instances.return_value = existing_stack_multi_reg
+        mock_session.client.return_value.get_paginator.return_value.paginate.return_value = [existing_stack_multi_reg]
         mock_session.client.return_value.describe_stack_instance.return_value = existing_stack_instance
         r = StackSetRollout('x0-test-stack', config)
         d = r.rollout_delete()
@@ -167,7 +167,7 @@ class TestGroupedRollout(unittest.TestCase):
                 'regions': regions,
                 'override': override
             })
-        mock_session.client.return_value.list_stack_instances.return_value = existing_stack_multi_reg
+        mock_session.client.return_value.get_paginator.return_value.paginate.return_value = [existing_stack_multi_reg]
         mock_session.client.return_value.describe_stack_instance.return_value = existing_stack_instance
         r = StackSetRollout('x0-test-stack', config)
         d = r.rollout_delete()